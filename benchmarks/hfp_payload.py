@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 Osmo Salomaa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Measure per-message cost of decoding HFP payloads."""
+
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import htl
+
+# Payloads in the HFP v1 format, as received from mqtt.hsl.fi.
+PAYLOADS = [
+    b'{"VP":{"desi":"65","dir":"1","oper":12,"veh":1314,"tst":"2018-06-18T11:33:41.519Z","tsi":1529321621,"spd":4.95,"hdg":237,"lat":60.176137,"long":24.938374,"acc":0.21,"dl":-19,"odo":7823,"drst":0,"oday":"2018-06-18","jrn":683,"line":123,"start":"14:33"}}',
+    b'{"VP":{"desi":"4","dir":"2","oper":40,"veh":412,"tst":"2018-06-18T11:33:42.001Z","tsi":1529321622,"spd":0.00,"hdg":91,"lat":60.183562,"long":24.912337,"acc":0.00,"dl":120,"odo":3321,"drst":1,"oday":"2018-06-18","jrn":1123,"line":31,"start":"14:31"}}',
+    b'{"VP":{"desi":"I","dir":"1","oper":90,"veh":6042,"tst":"2018-06-18T11:33:42.250Z","tsi":1529321622,"spd":22.14,"hdg":12,"lat":60.242917,"long":24.951023,"acc":-0.12,"dl":0,"odo":null,"drst":null,"oday":"2018-06-18","jrn":76,"line":279,"start":"14:12"}}',
+    b'{"VP":{"desi":"550","dir":"2","oper":22,"veh":931,"tst":"2018-06-18T11:33:42.731Z","tsi":1529321622,"spd":11.30,"hdg":170,"lat":60.223711,"long":24.873066,"acc":0.53,"dl":-45,"odo":14502,"drst":0,"oday":"2018-06-18","jrn":412,"line":880,"start":"14:40"}}',
+]
+
+KEYS = ("long", "lat", "hdg")
+
+def decode_before(blob):
+    """Decode `blob` the way it was done before."""
+    payload = json.loads(blob.decode("utf_8", errors="replace"))["VP"]
+    return float(payload["long"]), float(payload["lat"]), float(payload["hdg"])
+
+def decode_after(blob):
+    """Decode `blob` the way the HSL tracker does it now."""
+    payload = htl.payload.extract(blob, KEYS, root="VP")
+    return float(payload["long"]), float(payload["lat"]), float(payload["hdg"])
+
+def main():
+    n = 100000
+    for blob in PAYLOADS:
+        assert decode_before(blob) == decode_after(blob)
+    before = timeit.timeit(lambda: [decode_before(x) for x in PAYLOADS], number=n)
+    after = timeit.timeit(lambda: [decode_after(x) for x in PAYLOADS], number=n)
+    n *= len(PAYLOADS)
+    print("Before: {:.2f} µs per message".format(before / n * 10**6))
+    print("After:  {:.2f} µs per message".format(after / n * 10**6))
+
+if __name__ == "__main__":
+    main()
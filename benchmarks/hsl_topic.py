@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 Osmo Salomaa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Measure per-message cost of parsing HFP topics."""
+
+import importlib.machinery
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+TOPICS = [
+    "/hfp/v1/journey/ongoing/bus/0012/01314/1065/1/Munkkiniemi/14:33/1130106/4/60;24/19/73/68",
+    "/hfp/v1/journey/ongoing/tram/0040/00412/1004/2/Munkkiniemi/14:31/1130112/5/60;24/19/83/56",
+    "/hfp/v1/journey/ongoing/train/0090/06042/3001I/1/Helsinki/14:12/1020502/3/60;24/29/45/21",
+    "/hfp/v1/journey/ongoing/bus/0022/00931/2550/2/Itäkeskus/14:40/2222235/4/60;24/28/37/96",
+]
+
+def load_tracker():
+    """Return an unconnected HSL tracker."""
+    path = os.path.join(os.path.dirname(__file__), "..", "trackers", "hsl.py")
+    loader = importlib.machinery.SourceFileLoader("tracker", path)
+    module = loader.load_module("tracker")
+    class Tracker(module.Tracker):
+        def _init_client(self):
+            pass
+    return module, Tracker()
+
+def parse_before(tracker, topic):
+    """Parse `topic` the way it was done before using a regex and cache."""
+    topic = topic.split("/")
+    parse_type = lambda type: dict(bus="bus",
+                                   ferry="ferry",
+                                   metro="metro",
+                                   rail="train",
+                                   subway="metro",
+                                   train="train",
+                                   tram="tram").get(type.lower(), "")
+    return ("/".join(topic[6:8]),
+            topic[8],
+            tracker._parse_line(topic[8]),
+            parse_type(topic[5]))
+
+def parse_after(module, tracker, topic):
+    """Parse `topic` the way the tracker does it now."""
+    mode, id, code = module.RE_TOPIC.match(topic).groups()
+    line, type = tracker._parse_route(code, mode)
+    return id, code, line, type
+
+def main():
+    module, tracker = load_tracker()
+    n = 200000
+    for topic in TOPICS:
+        assert parse_before(tracker, topic) == parse_after(module, tracker, topic)
+    before = timeit.timeit(lambda: [parse_before(tracker, x) for x in TOPICS], number=n)
+    after = timeit.timeit(lambda: [parse_after(module, tracker, x) for x in TOPICS], number=n)
+    n *= len(TOPICS)
+    print("Before: {:.2f} µs per message".format(before / n * 10**6))
+    print("After:  {:.2f} µs per message".format(after / n * 10**6))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 Osmo Salomaa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Measure messages per second through the MQTT network loop."""
+
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import paho.mqtt.client as mqtt
+from mqtt_read import MESSAGES, encode
+
+def run(max_packets, bursts, burst):
+    """Return messages per second received in `bursts` with `max_packets`."""
+    received = []
+    client = mqtt.Client()
+    client.on_message = lambda client, userdata, message: received.append(message)
+    client._sock, remote = socket.socketpair()
+    client._sock.setblocking(0)
+    stream = b"".join(encode(*x) for x in MESSAGES * (burst // len(MESSAGES)))
+    def send():
+        for i in range(bursts):
+            remote.sendall(stream)
+            time.sleep(0.01)
+    total = bursts * len(MESSAGES) * (burst // len(MESSAGES))
+    thread = threading.Thread(target=send, daemon=True)
+    start = time.process_time()
+    thread.start()
+    while len(received) < total:
+        client.loop(timeout=1.0, max_packets=max_packets)
+    elapsed = time.process_time() - start
+    remote.close()
+    client._sock.close()
+    return total / elapsed
+
+def main():
+    repeat = 5
+    for max_packets in (1, 100, 0):
+        rate = statistics.median(run(max_packets, bursts=50, burst=400)
+                                 for i in range(repeat))
+        print("max_packets={:d}: {:.0f} messages per CPU second, median of {:d} runs"
+              .format(max_packets, rate, repeat))
+
+if __name__ == "__main__":
+    main()
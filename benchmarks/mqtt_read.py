@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 Osmo Salomaa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Measure per-message cost of reading MQTT packets from a socket."""
+
+import errno
+import os
+import socket
+import statistics
+import struct
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import paho.mqtt.client as mqtt
+
+# Messages in the HFP v1 format, as received from mqtt.hsl.fi.
+MESSAGES = [
+    ("/hfp/v1/journey/ongoing/bus/0012/01314/1065/1/Munkkiniemi/14:33/1130106/4/60;24/19/73/68",
+     b'{"VP":{"desi":"65","dir":"1","oper":12,"veh":1314,"tst":"2018-06-18T11:33:41.519Z","tsi":1529321621,"spd":4.95,"hdg":237,"lat":60.176137,"long":24.938374,"acc":0.21,"dl":-19,"odo":7823,"drst":0,"oday":"2018-06-18","jrn":683,"line":123,"start":"14:33"}}'),
+    ("/hfp/v1/journey/ongoing/tram/0040/00412/1004/2/Munkkiniemi/14:31/1130112/5/60;24/19/83/56",
+     b'{"VP":{"desi":"4","dir":"2","oper":40,"veh":412,"tst":"2018-06-18T11:33:42.001Z","tsi":1529321622,"spd":0.00,"hdg":91,"lat":60.183562,"long":24.912337,"acc":0.00,"dl":120,"odo":3321,"drst":1,"oday":"2018-06-18","jrn":1123,"line":31,"start":"14:31"}}'),
+    ("/hfp/v1/journey/ongoing/train/0090/06042/3001I/1/Helsinki/14:12/1020502/3/60;24/29/45/21",
+     b'{"VP":{"desi":"I","dir":"1","oper":90,"veh":6042,"tst":"2018-06-18T11:33:42.250Z","tsi":1529321622,"spd":22.14,"hdg":12,"lat":60.242917,"long":24.951023,"acc":-0.12,"dl":0,"odo":null,"drst":null,"oday":"2018-06-18","jrn":76,"line":279,"start":"14:12"}}'),
+    ("/hfp/v1/journey/ongoing/bus/0022/00931/2550/2/Itäkeskus/14:40/2222235/4/60;24/28/37/96",
+     b'{"VP":{"desi":"550","dir":"2","oper":22,"veh":931,"tst":"2018-06-18T11:33:42.731Z","tsi":1529321622,"spd":11.30,"hdg":170,"lat":60.223711,"long":24.873066,"acc":0.53,"dl":-45,"odo":14502,"drst":0,"oday":"2018-06-18","jrn":412,"line":880,"start":"14:40"}}'),
+]
+
+REPEAT = 9
+
+
+class FakeSocket:
+
+    """A non-blocking socket with `stream` waiting to be read."""
+
+    def __init__(self, stream):
+        self.pos = 0
+        self.stream = stream
+
+    def recv(self, size):
+        if self.pos >= len(self.stream):
+            raise socket.error(errno.EAGAIN, "Resource temporarily unavailable")
+        data = self.stream[self.pos:self.pos+size]
+        self.pos += len(data)
+        return data
+
+
+class ClientBefore(mqtt.Client):
+
+    """A client reading packets the way it was done before."""
+
+    def loop_read(self, max_packets=1):
+        while self._packet_read() != mqtt.MQTT_ERR_AGAIN: pass
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def _packet_read(self):
+        if self._in_packet['command'] == 0:
+            try:
+                command = self._sock.recv(1)
+            except socket.error as err:
+                if err.errno == errno.EAGAIN:
+                    return mqtt.MQTT_ERR_AGAIN
+                return 1
+            else:
+                if len(command) == 0:
+                    return 1
+                command = struct.unpack("!B", command)
+                self._in_packet['command'] = command[0]
+        if self._in_packet['have_remaining'] == 0:
+            while True:
+                try:
+                    byte = self._sock.recv(1)
+                except socket.error as err:
+                    if err.errno == errno.EAGAIN:
+                        return mqtt.MQTT_ERR_AGAIN
+                    return 1
+                else:
+                    byte = struct.unpack("!B", byte)
+                    byte = byte[0]
+                    self._in_packet['remaining_count'].append(byte)
+                    if len(self._in_packet['remaining_count']) > 4:
+                        return mqtt.MQTT_ERR_PROTOCOL
+                    self._in_packet['remaining_length'] = self._in_packet['remaining_length'] + (byte & 127)*self._in_packet['remaining_mult']
+                    self._in_packet['remaining_mult'] = self._in_packet['remaining_mult'] * 128
+                if (byte & 128) == 0:
+                    break
+            self._in_packet['have_remaining'] = 1
+            self._in_packet['to_process'] = self._in_packet['remaining_length']
+        while self._in_packet['to_process'] > 0:
+            try:
+                data = self._sock.recv(self._in_packet['to_process'])
+            except socket.error as err:
+                if err.errno == errno.EAGAIN:
+                    return mqtt.MQTT_ERR_AGAIN
+                return 1
+            else:
+                self._in_packet['to_process'] = self._in_packet['to_process'] - len(data)
+                self._in_packet['packet'] = self._in_packet['packet'] + data
+        self._in_packet['pos'] = 0
+        rc = self._packet_handle()
+        self._in_packet = dict(
+            command=0,
+            have_remaining=0,
+            remaining_count=[],
+            remaining_mult=1,
+            remaining_length=0,
+            packet=b"",
+            to_process=0,
+            pos=0)
+        self._msgtime_mutex.acquire()
+        self._last_msg_in = time.time()
+        self._msgtime_mutex.release()
+        return rc
+
+
+def encode(topic, payload):
+    """Return a QoS 0 PUBLISH packet of `topic` and `payload`."""
+    topic = topic.encode("utf_8")
+    body = struct.pack("!H", len(topic)) + topic + payload
+    length, remaining = bytearray(), len(body)
+    while True:
+        byte, remaining = remaining % 128, remaining // 128
+        length.append(byte | (128 if remaining else 0))
+        if not remaining: break
+    return bytes([mqtt.PUBLISH]) + bytes(length) + body
+
+def read(cls, stream):
+    """Read all packets in `stream` with a client of `cls`."""
+    received = []
+    client = cls()
+    client.on_message = lambda client, userdata, message: received.append(
+        (message.topic, message.payload))
+    client._sock = FakeSocket(stream)
+    client.read_budget_set(None)
+    client.loop_read(0)
+    return received
+
+def main():
+    n = 10
+    # A recording of a busy subscription, as it would be
+    # waiting in the socket buffer at a select wakeup.
+    messages = MESSAGES * 250
+    stream = b"".join(encode(*x) for x in messages)
+    assert read(ClientBefore, stream) == messages
+    assert read(mqtt.Client, stream) == messages
+    times = {ClientBefore: [], mqtt.Client: []}
+    # Alternate between clients so that changes in machine load
+    # affect both alike and report medians to skip outliers.
+    for i in range(REPEAT):
+        for cls, results in times.items():
+            results.append(timeit.timeit(lambda: read(cls, stream), number=n))
+    before = statistics.median(times[ClientBefore])
+    after = statistics.median(times[mqtt.Client])
+    n *= len(messages)
+    print("Before: {:.2f} µs per message, median of {:d} runs"
+          .format(before / n * 10**6, REPEAT))
+    print("After:  {:.2f} µs per message, median of {:d} runs"
+          .format(after / n * 10**6, REPEAT))
+
+if __name__ == "__main__":
+    main()
@@ -34,7 +34,13 @@ except ImportError:
 from htl.paths import *
 from htl import util
 from htl import http
+from htl import payload
+from htl.dispatcher import *
+from htl.expiry import *
 from htl.filters import *
+from htl.handoff import *
+from htl.registry import *
+from htl.spatial import *
 from htl.tracker import *
 from htl.application import *
 
@@ -18,28 +18,84 @@
 """Show real-time locations of HSL public transportation vehicles."""
 
 import htl
-import pyotherside
+import os
 import time
 
 __all__ = ("Application",)
 
+SNAPSHOT_VERSION = 1
+
 
 class Application:
 
     """Show real-time locations of HSL public transportation vehicles."""
 
-    def __init__(self):
-        """Initialize an :class:`Application` instance."""
+    def __init__(self, ttl=180, margin=0.5, overflow="coalesce", max_age=600):
+        """
+        Initialize an :class:`Application` instance.
+
+        Vehicles not updated for `ttl` seconds are removed from the map.
+        Vehicles are sent to QML only if within the viewport, extended
+        on all sides by `margin` times the viewport's width or height.
+        `overflow` is the policy of the queue of vehicle updates from
+        trackers, see :class:`htl.Handoff`. Vehicles saved at the end of
+        the previous session are shown at start as provisional, unless
+        last updated more than `max_age` seconds ago, and are removed if
+        not updated within `ttl`, or once `max_age` has passed if longer.
+        """
         self.filters = htl.Filters("hsl")
+        self.margin = margin
+        self.max_age = max_age
+        self._dispatcher = htl.Dispatcher()
+        self._expiry = htl.ExpiryScheduler(ttl, self._expire_vehicle)
+        self._handoff = htl.Handoff(self._update_vehicle, policy=overflow)
+        self._index = htl.SpatialIndex()
         self._lines = []
+        self.registry = htl.VehicleRegistry()
+        self._snapshot_path = os.path.join(htl.CACHE_HOME_DIR, "vehicles.json")
         self._times_started = 0
         self._tracker = htl.Tracker("hsl")
-        self._utimes = {}
+        self._viewport = None
+        self._zoom = None
+
+    def _dispatch(self, vehicle):
+        """Queue `vehicle` to be sent to QML."""
+        vehicle["color"] = htl.util.type_to_color(vehicle["type"])
+        self._dispatcher.put(vehicle)
 
     def bootstrap(self):
         """Fetch the last known positions of vehicles."""
         return self._tracker.bootstrap()
 
+    def _expire_vehicle(self, id):
+        """Remove vehicle `id` if not updated for :attr:`ttl`."""
+        # The vehicle can be touched between the scheduler finding it
+        # expired and this call, in which case it has a new deadline.
+        self.remove_vehicle(id, before=time.time() - self._expiry.ttl)
+
+    def get_stats(self):
+        """Return a dictionary of counters of vehicle updates."""
+        stats = dict(getattr(self._tracker, "stats", {}))
+        stats["dropped"] = self._handoff.stats["dropped"]
+        stats["coalesced"] = self._handoff.stats["coalesced"]
+        stats["stale"] = self._handoff.stats["stale"]
+        return stats
+
+    def get_viewport(self):
+        """Return the visible area of the map, including margin, or ``None``."""
+        return self._viewport
+
+    def get_zoom(self):
+        """Return the zoom level of the map or ``None``."""
+        return self._zoom
+
+    def _in_viewport(self, x, y, viewport=None):
+        """Return ``True`` if `x`, `y` is within viewport and margin."""
+        viewport = viewport or self._viewport
+        if viewport is None: return True
+        return (viewport[0] <= x <= viewport[2] and
+                viewport[1] <= y <= viewport[3])
+
     def list_lines(self):
         """Return a list of available lines."""
         # Cache list of lines, assuming it is acquired via
@@ -54,32 +110,155 @@ class Application:
     def quit(self):
         """Quit the application."""
         self.filters.write()
+        self._write_snapshot()
         self._tracker.quit()
+        self._handoff.stop()
+        self._dispatcher.stop()
+        self._expiry.stop()
         htl.http.pool.terminate()
 
+    def _read_snapshot(self):
+        """Show vehicles saved at the end of the previous session."""
+        if not os.path.isfile(self._snapshot_path): return
+        with htl.util.silent(Exception, tb=True):
+            snapshot = htl.util.read_json(self._snapshot_path)
+            if snapshot.get("version") != SNAPSHOT_VERSION:
+                raise ValueError("Bad snapshot version: {}".format(
+                    repr(snapshot.get("version"))))
+            now = time.time()
+            ttl = self._expiry.ttl
+            max_age = max(self.max_age, ttl)
+            ids = self.registry.load(snapshot["vehicles"], self.max_age)
+            for id in ids:
+                # Show as provisional until the first live update
+                # or bootstrap confirms that the vehicle is around.
+                vehicle = self.registry.get(id)
+                vehicle["provisional"] = True
+                self._index.update(id, vehicle["x"], vehicle["y"])
+                # Allow a full ttl for the first update to arrive,
+                # but don't show beyond max_age since the last one.
+                utime = self.registry.get_utime(id)
+                deadline = min(now + ttl, utime + max_age)
+                self._expiry.touch(id, deadline - ttl)
+                if deadline <= now: continue
+                self._dispatch(vehicle)
+
+    def remove_vehicle(self, id, before=None):
+        """
+        Remove vehicle `id` from QML map and all state kept.
+
+        If `before` is given, remove only if last updated before it.
+        """
+        removed = self.registry.remove(id, before)
+        if before is not None and not removed: return
+        self._index.remove(id)
+        self._dispatcher.remove(id)
+        self._expiry.discard(id)
+        if hasattr(self._tracker, "remove_vehicle"):
+            self._tracker.remove_vehicle(id)
+
+    def set_viewport(self, bbox, zoom=None):
+        """
+        Set the visible area of the map as `xmin, ymin, xmax, ymax`.
+
+        `zoom` is the zoom level of the map, if available, which is kept
+        for :meth:`get_zoom`. Vehicles are culled based on `bbox` alone.
+        """
+        self._zoom = None if zoom is None else float(zoom)
+        xmin, ymin, xmax, ymax = map(float, bbox)
+        dx = self.margin * (xmax - xmin)
+        dy = self.margin * (ymax - ymin)
+        viewport = (xmin - dx, ymin - dy, xmax + dx, ymax + dy)
+        prev, self._viewport = self._viewport, viewport
+        # Vehicles outside the previous viewport have not been kept up
+        # to date in QML, send the latest state of those scrolled in.
+        scrolled_in = False
+        for id in self._index.query(viewport):
+            vehicle = self.registry.get(id)
+            if vehicle is None: continue
+            x, y = vehicle["x"], vehicle["y"]
+            if not self._in_viewport(x, y, viewport): continue
+            if prev and self._in_viewport(x, y, prev): continue
+            self._dispatch(vehicle)
+            scrolled_in = True
+        if scrolled_in:
+            self._dispatcher.flush_soon()
+        if self.filters.get_area():
+            self.update_filters()
+
     def start(self):
         """Start threaded periodic updates."""
+        # Connect in the background while reading the snapshot and
+        # starting consumers. The tracker's first requests, e.g. bootstrap,
+        # wait for and reuse these connections instead of opening new ones.
+        for url in getattr(self._tracker, "urls", []):
+            htl.http.pool.prewarm(url)
         if self._times_started == 0:
+            self._read_snapshot()
             self.update_filters()
+        # Start consumers before the tracker so that
+        # the bootstrap doesn't overflow the handoff.
+        self._handoff.start()
+        self._dispatcher.start()
+        self._expiry.start()
         self._tracker.start()
         self._times_started += 1
 
     def stop(self):
         """Stop threaded periodic updates."""
         self._tracker.stop()
+        self._handoff.stop()
+        self._dispatcher.stop()
+        self._expiry.stop()
+        self._write_snapshot()
+
+    def touch_vehicle(self, id):
+        """
+        Mark vehicle `id` as updated without changes in position.
+
+        Return ``False`` if vehicle is not found, e.g. if it has been removed
+        or its first update is still queued, in which case the tracker should
+        send an update instead.
+        """
+        if not self.registry.touch(id): return False
+        self._expiry.touch(id)
+        return True
 
     def update_filters(self):
         """Update vehicle filters, return ``True`` if changed."""
         return self._tracker.update_filters()
 
-    def update_vehicle(self, vehicle):
+    def update_vehicle(self, vehicle, timestamp=None):
+        """
+        Update `vehicle` in QML map or add if missing.
+
+        `timestamp` is the time the position was recorded, if available,
+        used to never replace a position with an older one, e.g. when
+        merging a bootstrap with live updates.
+        This can be called from the tracker's network thread, the actual
+        update is done in a separate thread to never block the caller.
+        """
+        self._handoff.put(vehicle["id"],
+                          vehicle,
+                          timestamp,
+                          order=timestamp)
+
+    def _update_vehicle(self, vehicle, timestamp=None):
         """Update `vehicle` in QML map or add if missing."""
-        if vehicle["id"] in self._utimes:
-            # XXX: QML gets confused if we send updates faster than
-            # the QML animation duration. We might need a queue here,
-            # instead of just discarding updates.
-            utime = self._utimes[vehicle["id"]]
-            if time.time() - utime < 3.5: return
-        vehicle["color"] = htl.util.type_to_color(vehicle["type"])
-        pyotherside.send("update-vehicle", vehicle)
-        self._utimes[vehicle["id"]] = time.time()
+        if timestamp is not None:
+            prev = self.registry.get_timestamp(vehicle["id"])
+            if prev is not None and timestamp < prev:
+                self._handoff.stats["stale"] += 1
+                return
+        self.registry.update(vehicle, timestamp=timestamp)
+        self._index.update(vehicle["id"], vehicle["x"], vehicle["y"])
+        self._expiry.touch(vehicle["id"])
+        if self._in_viewport(vehicle["x"], vehicle["y"]):
+            self._dispatch(vehicle)
+
+    def _write_snapshot(self):
+        """Save vehicles to be shown at the start of the next session."""
+        snapshot = dict(version=SNAPSHOT_VERSION,
+                        vehicles=self.registry.dump())
+        with htl.util.silent(Exception, tb=True):
+            htl.util.write_json(snapshot, self._snapshot_path, compact=True)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 Osmo Salomaa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Coalescing relay of vehicle updates to QML."""
+
+import htl
+import pyotherside
+import threading
+import time
+
+__all__ = ("Dispatcher",)
+
+
+class Dispatcher:
+
+    """Coalescing relay of vehicle updates to QML."""
+
+    def __init__(self, interval=1, window=3.5):
+        """Initialize a :class:`Dispatcher` instance."""
+        self.interval = interval
+        self.window = window
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._removed = set()
+        self._sent = {}
+        self._stopped = threading.Event()
+        self._stopped.set()
+        self._wakeup = threading.Event()
+
+    def flush(self):
+        """
+        Send all due pending vehicle updates to QML in one go.
+
+        Return the amount of seconds until the next held back update is due,
+        or :attr:`interval` if there's nothing held back.
+        """
+        # QML gets confused if we send updates faster than the QML
+        # animation duration. Hold back the latest state of vehicles
+        # updated within window and release once the window expires.
+        with self._lock:
+            removed = list(self._removed)
+            self._removed.clear()
+            now = time.time()
+            vehicles = []
+            wait = self.interval
+            for id in list(self._pending):
+                age = now - self._sent.get(id, 0)
+                if age < self.window:
+                    wait = min(wait, self.window - age)
+                    continue
+                vehicles.append(self._pending.pop(id))
+                self._sent[id] = now
+        # Send outside the lock so that a slow bridge
+        # doesn't block callers queueing new updates.
+        for id in removed:
+            pyotherside.send("remove-vehicle", id)
+        if vehicles:
+            pyotherside.send("update-vehicles", vehicles)
+        return wait
+
+    def flush_soon(self):
+        """Flush pending updates without waiting for the next tick."""
+        self._wakeup.set()
+
+    @htl.util.locked_method
+    def put(self, vehicle):
+        """Queue `vehicle` to be sent, replacing earlier pending state."""
+        self._pending[vehicle["id"]] = vehicle
+        self._removed.discard(vehicle["id"])
+
+    @htl.util.locked_method
+    def remove(self, id):
+        """Queue vehicle `id` to be removed, dropping pending state."""
+        # Removals are sent from flush to ensure that an update
+        # being sent can't arrive in QML after the removal.
+        self._pending.pop(id, None)
+        self._sent.pop(id, None)
+        self._removed.add(id)
+
+    def _run(self, stopped):
+        """Flush pending updates periodically until `stopped` is set."""
+        wait = self.interval
+        while True:
+            self._wakeup.wait(wait)
+            self._wakeup.clear()
+            if stopped.is_set(): break
+            wait = self.interval
+            with htl.util.silent(Exception, tb=True):
+                wait = self.flush()
+
+    def start(self):
+        """Start flushing pending updates periodically."""
+        if not self._stopped.is_set(): return
+        # Use a new event for each thread so that a quick stop-start
+        # cycle can't leave an old thread running alongside a new one.
+        self._stopped = threading.Event()
+        threading.Thread(target=self._run,
+                         args=(self._stopped,),
+                         daemon=True).start()
+
+    def stop(self):
+        """Stop flushing pending updates."""
+        self._stopped.set()
+        self._wakeup.set()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 Osmo Salomaa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Expiration of vehicles that have gone silent."""
+
+import heapq
+import htl
+import threading
+import time
+
+__all__ = ("ExpiryScheduler",)
+
+
+class ExpiryScheduler:
+
+    """
+    Expiration of vehicles that have gone silent.
+
+    Call :meth:`touch` whenever a vehicle is updated. `callback` is called
+    from a background thread with the vehicle id as argument once a vehicle
+    has not been touched for `ttl` seconds.
+    """
+
+    def __init__(self, ttl, callback):
+        """Initialize an :class:`ExpiryScheduler` instance."""
+        self.callback = callback
+        self.ttl = ttl
+        self._cond = threading.Condition()
+        self._deadlines = {}
+        self._heap = []
+        self._paused = time.time()
+        self._queued = set()
+        self._stopped = threading.Event()
+        self._stopped.set()
+
+    def discard(self, id):
+        """Stop tracking expiration of vehicle `id`."""
+        with self._cond:
+            self._deadlines.pop(id, None)
+
+    def _pop_expired(self):
+        """Remove and return ids of expired vehicles."""
+        expired = []
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now:
+            # The heap holds at most one entry per vehicle, with deadlines
+            # updated lazily. If the vehicle has been touched since the
+            # entry was pushed, push it back with its current deadline.
+            deadline, id = heapq.heappop(self._heap)
+            self._queued.discard(id)
+            if not id in self._deadlines: continue
+            if self._deadlines[id] > now:
+                self._push(id)
+                continue
+            del self._deadlines[id]
+            expired.append(id)
+        return expired
+
+    def _push(self, id):
+        """Push vehicle `id` into the heap with its current deadline."""
+        heapq.heappush(self._heap, (self._deadlines[id], id))
+        self._queued.add(id)
+
+    def _run(self, stopped):
+        """Expire vehicles as deadlines pass until `stopped` is set."""
+        while not stopped.is_set():
+            with self._cond:
+                expired = self._pop_expired()
+                if not expired:
+                    wait = self._heap[0][0] - time.time() if self._heap else None
+                    self._cond.wait(wait)
+                    continue
+            for id in expired:
+                with htl.util.silent(Exception, tb=True):
+                    self.callback(id)
+
+    def start(self):
+        """Start expiring vehicles in a background thread."""
+        if not self._stopped.is_set(): return
+        with self._cond:
+            # Don't count time spent stopped, i.e. in the background
+            # without receiving updates, towards vehicles' silence.
+            paused = time.time() - self._paused
+            for id in self._deadlines:
+                self._deadlines[id] += paused
+            self._stopped = threading.Event()
+        threading.Thread(target=self._run,
+                         args=(self._stopped,),
+                         daemon=True).start()
+
+    def stop(self):
+        """Stop expiring vehicles."""
+        with self._cond:
+            if self._stopped.is_set(): return
+            self._paused = time.time()
+            self._stopped.set()
+            self._cond.notify_all()
+
+    def touch(self, id, utime=None):
+        """
+        Postpone expiration of vehicle `id` by :attr:`ttl`.
+
+        `utime` is the time the vehicle was last updated, if not now,
+        in which case the vehicle expires :attr:`ttl` after `utime`.
+        """
+        with self._cond:
+            utime = time.time() if utime is None else utime
+            self._deadlines[id] = utime + self.ttl
+            if id in self._queued: return
+            notify = not self._heap or self._deadlines[id] < self._heap[0][0]
+            self._push(id)
+            if notify:
+                self._cond.notify_all()
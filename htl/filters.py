@@ -40,6 +40,10 @@ class Filters:
         if not line in self._filters[self.id]["lines"]:
             self._filters[self.id]["lines"].append(line)
 
+    def get_area(self):
+        """Return ``True`` if tracking only vehicles in the visible area."""
+        return self._filters[self.id]["area"]
+
     def get_filters(self):
         """Return a dictionary of vehicle filters."""
         return copy.deepcopy(self._filters[self.id])
@@ -58,12 +62,18 @@ class Filters:
         for id in self._filters:
             if not "lines" in self._filters[id]:
                 self._filters[id]["lines"] = []
+            if not "area" in self._filters[id]:
+                self._filters[id]["area"] = False
 
     def remove_line(self, line):
         """Remove `line` from the list of line filters."""
         with htl.util.silent(ValueError):
             self._filters[self.id]["lines"].remove(line)
 
+    def set_area(self, area):
+        """Set whether to track only vehicles in the visible area."""
+        self._filters[self.id]["area"] = bool(area)
+
     def write(self):
         """Write list of filters to file."""
         for id in self._filters:
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 Osmo Salomaa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Bounded non-blocking handoff of work to a dedicated thread."""
+
+import collections
+import htl
+import threading
+
+__all__ = ("Handoff",)
+
+
+class Handoff:
+
+    """
+    Bounded non-blocking handoff of work to a dedicated thread.
+
+    Items are queued by key and `callback` is called with each item's
+    arguments in a background thread. :meth:`put` never blocks: if the
+    queue is full, the oldest item is dropped. If an item with the same key
+    is already queued, `policy` determines what happens: "coalesce" replaces
+    the queued arguments keeping the item's place in the queue, "drop-oldest"
+    drops the queued item and adds the new one at the end of the queue.
+    """
+
+    def __init__(self, callback, size=2000, policy="coalesce"):
+        """Initialize a :class:`Handoff` instance."""
+        if not policy in ("coalesce", "drop-oldest"):
+            raise ValueError("Bad policy: {}".format(repr(policy)))
+        self.callback = callback
+        self.policy = policy
+        self.size = size
+        self.stats = collections.Counter()
+        self._cond = threading.Condition()
+        self._queue = collections.OrderedDict()
+        self._stopped = threading.Event()
+        self._stopped.set()
+
+    def put(self, key, *args, order=None):
+        """
+        Queue `args` to be passed to `callback`.
+
+        If `order` is given, e.g. a timestamp, and an item with the same key
+        and a greater `order` is already queued, discard `args` as stale.
+        """
+        with self._cond:
+            self.stats["queued"] += 1
+            if key in self._queue:
+                prev = self._queue[key][0]
+                if not None in (prev, order) and order < prev:
+                    self.stats["stale"] += 1
+                    return
+                self.stats["coalesced"] += 1
+                if self.policy == "drop-oldest":
+                    del self._queue[key]
+            elif len(self._queue) >= self.size:
+                self.stats["dropped"] += 1
+                self._queue.popitem(last=False)
+            self._queue[key] = (order, args)
+            self._cond.notify()
+
+    def _run(self, stopped):
+        """Pass queued items to `callback` until `stopped` is set."""
+        while True:
+            with self._cond:
+                while not self._queue and not stopped.is_set():
+                    self._cond.wait()
+                if stopped.is_set(): break
+                key, (order, args) = self._queue.popitem(last=False)
+            with htl.util.silent(Exception, tb=True):
+                self.callback(*args)
+
+    def start(self):
+        """Start passing queued items to `callback`."""
+        with self._cond:
+            if not self._stopped.is_set(): return
+            self._stopped = threading.Event()
+        threading.Thread(target=self._run,
+                         args=(self._stopped,),
+                         daemon=True).start()
+
+    def stop(self):
+        """Stop passing queued items to `callback`."""
+        with self._cond:
+            self._stopped.set()
+            self._cond.notify_all()
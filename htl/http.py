@@ -17,14 +17,20 @@
 
 """Managed persistent HTTP connections."""
 
+import collections
+import concurrent.futures
+import hashlib
 import htl
 import http.client
 import json
-import queue
+import os
 import re
+import ssl
 import sys
 import threading
+import time
 import urllib.parse
+import zlib
 
 BROKEN_CONNECTION_ERRORS = [
     BrokenPipeError,
@@ -33,6 +39,7 @@ BROKEN_CONNECTION_ERRORS = [
 ]
 
 HEADERS = {
+    "Accept-Encoding": "gzip, deflate",
     "Connection": "Keep-Alive",
     "User-Agent": "helsinki-transit-live/{}".format(htl.__version__),
 }
@@ -42,51 +49,127 @@ RE_LOCALHOST = re.compile(r"://(127.0.0.1|localhost)\b")
 
 class ConnectionPool:
 
-    """A managed pool of persistent per-host HTTP connections."""
+    """
+    A managed pool of persistent per-host HTTP connections.
+
+    At most `threads` connections per host and `limit` connections in total
+    are lent out at a time, callers of :meth:`get` waiting beyond that in
+    the order they arrived. Connections returned to the pool are kept open
+    for reuse, while the total amount of open connections stays within
+    `limit`, closing the least recently used idle ones as needed. Idle
+    connections are closed once idle for more than `max_idle` seconds or
+    open for more than `max_lifetime` seconds, since by then servers
+    and middleboxes are likely to have dropped them.
+    """
 
-    def __init__(self, threads):
+    def __init__(self, threads, limit=None, max_idle=60, max_lifetime=600):
         """Initialize a :class:`ConnectionPool` instance."""
         self._alive = True
-        self._all_connections = set()
-        self._lock = threading.Lock()
-        self._queue = {}
+        self._busy = {}
+        self._cond = threading.Condition()
+        self._created = {}
+        self._idle = {}
+        self._lent = set()
+        self._limit = limit
+        self._max_idle = max_idle
+        self._max_lifetime = max_lifetime
         self._threads = threads
+        self._timer = None
+        self._waiters = collections.deque()
+        self._warming = set()
 
-    @htl.util.locked_method
-    def _allocate(self, url):
-        """Initialize a queue of HTTP connections to `url`."""
-        key = self._get_key(url)
-        if key in self._queue: return
-        self._queue[key] = queue.LifoQueue()
-        for i in range(self._threads):
-            self._queue[key].put(None)
+    def _can_lend(self, key):
+        """Return ``True`` if a connection to `key` can be lent out."""
+        # Wait for a connection being opened by prewarm
+        # rather than open another one in parallel.
+        if key in self._warming: return False
+        if self._busy.get(key, 0) >= self._threads: return False
+        if self._limit is None: return True
+        return sum(self._busy.values()) < self._limit
+
+    def _drop(self, connection):
+        """Close `connection` and stop tracking it."""
+        self._created.pop(connection, None)
+        with htl.util.silent(Exception):
+            connection.close()
+
+    def _evict(self):
+        """Close idle connections beyond the total limit."""
+        if self._limit is None: return
+        while (sum(self._busy.values()) +
+               sum(map(len, self._idle.values())) > self._limit):
+            idle = [x for x in self._idle.values() if x]
+            if not idle: break
+            # Close the least recently used idle connection.
+            idle = min(idle, key=lambda x: x[0][0])
+            used, connection = idle.pop(0)
+            self._drop(connection)
 
     def get(self, url):
         """Return an HTTP connection to `url`."""
         key = self._get_key(url)
-        if not key in self._queue:
-            self._allocate(url)
-        while True:
-            # Make sure no Queue.get call is left blocking
-            # once the connection pool has been terminated.
-            if not self._alive:
-                raise Exception("Pool terminated, get aborted")
-            with htl.util.silent(queue.Empty):
-                connection = self._queue[key].get(timeout=1)
-                break
-        if connection is None:
-            connection = self._new(url)
-        return connection
+        with self._cond:
+            waiter = [key]
+            self._waiters.append(waiter)
+            try:
+                while True:
+                    if not self._alive:
+                        raise Exception("Pool terminated, get aborted")
+                    if self._is_turn(waiter): break
+                    self._cond.wait()
+            finally:
+                self._waiters.remove(waiter)
+                # Let the next waiter check if it can go too.
+                self._cond.notify_all()
+            self._busy[key] = self._busy.get(key, 0) + 1
+            self._prune()
+            connection = None
+            while self._idle.get(key):
+                used, candidate = self._idle[key].pop()
+                if self._probe(candidate):
+                    connection = candidate
+                    break
+                self._drop(candidate)
+            if connection is None:
+                connection = self._new(url)
+                self._created[connection] = time.time()
+            self._lent.add(connection)
+            self._evict()
+            return connection
+
+    def get_capacity(self, urls):
+        """Return the amount of connections to `urls` lendable at once."""
+        hosts = set(map(self._get_key, urls))
+        with self._cond:
+            capacity = len(hosts) * self._threads
+            if self._limit is None: return capacity
+            return min(capacity, self._limit)
 
     def _get_key(self, url):
         """Return a dictionary key for the host of `url`."""
         components = urllib.parse.urlparse(url)
         return "{}:{}".format(components.scheme, components.netloc)
 
+    def get_stats(self):
+        """Return a dictionary of amounts of connections and waiters."""
+        with self._cond:
+            return dict(idle=sum(map(len, self._idle.values())),
+                        lent=len(self._lent),
+                        waiting=len(self._waiters))
+
     def is_alive(self):
         """Return ``True`` if pool is in use."""
         return self._alive
 
+    def _is_turn(self, waiter):
+        """Return ``True`` if `waiter` is first in line to be lent to."""
+        # Skip over waiters that can't be served right now due to
+        # per-host limits, but otherwise serve in order of arrival.
+        for item in self._waiters:
+            if self._can_lend(item[0]):
+                return item is waiter
+        return False
+
     def _new(self, url):
         """Initialize and return a new HTTP connection to `url`."""
         components = urllib.parse.urlparse(url)
@@ -100,16 +183,113 @@ class ConnectionPool:
         # can make e.g. a routing query take a long time.
         # https://github.com/otsaloma/poor-maps/issues/23
         timeout = (600 if RE_LOCALHOST.search(url) else 15)
-        connection = cls(components.netloc, timeout=timeout)
-        self._all_connections.add(connection)
-        return connection
+        return cls(components.netloc, timeout=timeout)
+
+    def prewarm(self, url):
+        """
+        Open a connection to `url` in the background.
+
+        Do nothing if there already is a connection to the host of `url`.
+        This allows doing DNS lookup, TCP connection and TLS handshake ahead
+        of time, so that the first request doesn't need to wait for them.
+        Calls to :meth:`get` for the same host wait for the connection.
+        """
+        key = self._get_key(url)
+        with self._cond:
+            self._prune()
+            if (self._idle.get(key) or
+                self._busy.get(key) or
+                key in self._warming): return
+            self._warming.add(key)
+        def connect():
+            connection = None
+            with htl.util.silent(Exception):
+                connection = self._new(url)
+                connection.connect()
+            with self._cond:
+                self._warming.discard(key)
+                self._cond.notify_all()
+                if connection is None: return
+                if self._alive and connection.sock is not None:
+                    self._created[connection] = time.time()
+                    self._idle.setdefault(key, []).append(
+                        (time.time(), connection))
+                    self._prune()
+                    self._evict()
+                    return
+                self._drop(connection)
+        threading.Thread(target=connect, daemon=True).start()
+
+    def _probe(self, connection):
+        """Return ``True`` if idle `connection` seems to be open."""
+        sock = connection.sock
+        if sock is None: return False
+        timeout = sock.gettimeout()
+        try:
+            # An idle connection should have nothing to read: a read that
+            # would block means the connection is open, an empty read means
+            # it has been closed by the server and data is unexpected.
+            sock.setblocking(False)
+            sock.recv(1)
+            return False
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return True
+        except Exception:
+            return False
+        finally:
+            with htl.util.silent(Exception):
+                sock.settimeout(timeout)
+
+    def _prune(self):
+        """Close idle connections past their maximum idle time or lifetime."""
+        now = time.time()
+        due = []
+        for key, idle in self._idle.items():
+            for item in list(idle):
+                used, connection = item
+                created = self._created.get(connection, now)
+                if (now - used > self._max_idle or
+                    now - created > self._max_lifetime):
+                    idle.remove(item)
+                    self._drop(connection)
+                    continue
+                due.append(min(used + self._max_idle,
+                               created + self._max_lifetime))
+        # Prune again once the next idle connection is due, so that
+        # connections don't stay open if the pool goes unused.
+        if due and self._alive and self._timer is None:
+            self._timer = threading.Timer(min(due) - now + 0.1,
+                                          self._prune_later)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _prune_later(self):
+        """Close idle connections past their maximum idle time or lifetime."""
+        with self._cond:
+            self._timer = None
+            self._prune()
 
     def put(self, url, connection):
-        """Return `connection` to the pool of connections."""
-        if not self._alive: return
+        """
+        Return `connection` to the pool of connections.
+
+        `connection` is kept for reuse if it's open, i.e. has been used
+        and not closed. Close broken connections before returning them.
+        """
         key = self._get_key(url)
-        self._queue[key].task_done()
-        self._queue[key].put(connection)
+        with self._cond:
+            if not connection in self._lent: return
+            self._lent.remove(connection)
+            self._busy[key] -= 1
+            self._cond.notify_all()
+            if (self._alive and
+                connection.sock is not None and
+                self._busy[key] + len(self._idle.get(key, ())) < self._threads):
+                self._idle.setdefault(key, []).append((time.time(), connection))
+                self._prune()
+                self._evict()
+                return
+            self._drop(connection)
 
     def reset(self, url):
         """Close and re-establish HTTP connection to `url`."""
@@ -117,39 +297,366 @@ class ConnectionPool:
         connection = self.get(url)
         with htl.util.silent(Exception):
             connection.close()
-        self.put(url, None)
+        self.put(url, connection)
+
+    def resize(self, threads, limit=None):
+        """
+        Set the maximum amount of connections per host and in total.
+
+        If growing, waiters are served right away. If shrinking, excess
+        connections are closed as they are returned to the pool.
+        """
+        with self._cond:
+            self._threads = threads
+            self._limit = limit
+            self._cond.notify_all()
 
-    @htl.util.locked_method
     def terminate(self):
         """Close all connections and terminate."""
-        if not self._alive: return
-        for connection in self._all_connections:
-            with htl.util.silent(Exception):
-                connection.close()
-        # Mark as dead so that subsequent operations fail.
-        self._alive = False
+        with self._cond:
+            if not self._alive: return
+            # Mark as dead so that subsequent operations fail.
+            self._alive = False
+            if self._timer is not None:
+                self._timer.cancel()
+            connections = list(self._lent)
+            for idle in self._idle.values():
+                connections.extend(x[1] for x in idle)
+            self._idle.clear()
+            self._cond.notify_all()
+            for connection in connections:
+                self._drop(connection)
+
+
+class ResponseCache:
+
+    """
+    On-disk cache of HTTP GET responses.
+
+    Response data is stored in `directory` along with validators, i.e. ETag
+    and Last-Modified headers. Entries are fresh for the max-age given by the
+    server or `max_age` seconds by default, after which they are revalidated
+    with a conditional request that the server can answer without resending
+    data that has not changed.
+    """
+
+    def __init__(self, directory, max_age=3600):
+        """Initialize a :class:`ResponseCache` instance."""
+        self.directory = directory
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._refreshing = set()
+
+    def get(self, url, retry=1, headers=None, stale=False):
+        """
+        Return response data of GET request at `url` as bytes.
+
+        If `stale` is ``True``, return a stale entry right away and revalidate
+        it in a background thread, so that the next call will be up to date.
+        """
+        entry = self._read(url)
+        if entry is not None:
+            meta, blob = entry
+            if time.time() < meta["expires"]:
+                return blob
+            if stale:
+                self._refresh(url, retry, headers)
+                return blob
+        return self._revalidate(url, entry, retry, headers)
+
+    def _get_max_age(self, response):
+        """Return the amount of seconds `response` is fresh for."""
+        control = response.getheader("Cache-Control", "")
+        if re.search(r"\bno-cache\b", control): return 0
+        match = re.search(r"\bmax-age=(\d+)", control)
+        return int(match.group(1)) if match else self.max_age
 
+    def _get_path(self, url):
+        """Return path of cache files for `url` without extension."""
+        key = hashlib.sha1(url.encode("utf_8")).hexdigest()
+        return os.path.join(self.directory, key)
 
-pool = ConnectionPool(1)
+    def _read(self, url):
+        """Return metadata and data of cached `url` or ``None``."""
+        path = self._get_path(url)
+        if not os.path.isfile(path + ".json"): return None
+        with htl.util.silent(Exception):
+            meta = htl.util.read_json(path + ".json")
+            # Guard against the unlikely hash collision.
+            if meta["url"] != url: return None
+            with open(path + ".body", "rb") as f:
+                return meta, f.read()
+        return None
+
+    def _refresh(self, url, retry=1, headers=None):
+        """Revalidate cached `url` in a background thread."""
+        with self._lock:
+            if url in self._refreshing: return
+            self._refreshing.add(url)
+        def refresh():
+            try:
+                with htl.util.silent(Exception):
+                    self._revalidate(url, self._read(url), retry, headers)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(url)
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def _revalidate(self, url, entry=None, retry=1, headers=None):
+        """Request `url`, conditionally if `entry` given, and return data."""
+        headall = dict(headers or {})
+        if entry is not None:
+            meta, blob = entry
+            if meta.get("etag"):
+                headall["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headall["If-Modified-Since"] = meta["last_modified"]
+        response, data = _fetch("GET", url, None, retry, headall)
+        if response.status == 304 and entry is not None:
+            # Data has not changed, only update metadata.
+            self._write(url, response, meta=meta)
+            return blob
+        _check_status("GET", response)
+        self._write(url, response, data)
+        return data
+
+    def _write(self, url, response, blob=None, meta=None):
+        """Write `response` to cache, with data `blob` if given."""
+        if "no-store" in response.getheader("Cache-Control", ""): return
+        meta = dict(meta or {}, url=url)
+        for key, name in (("etag", "ETag"), ("last_modified", "Last-Modified")):
+            value = response.getheader(name)
+            if value: meta[key] = value
+        meta["expires"] = time.time() + self._get_max_age(response)
+        path = self._get_path(url)
+        with htl.util.silent(Exception, tb=True):
+            if blob is not None:
+                htl.util.makedirs(self.directory)
+                with htl.util.atomic_open(path + ".body", "wb") as f:
+                    f.write(blob)
+            htl.util.write_json(meta, path + ".json")
+
+
+pool = ConnectionPool(4, limit=8)
+response_cache = ResponseCache(os.path.join(htl.CACHE_HOME_DIR, "http"))
+stats = collections.Counter()
+
+# In-progress requests shared by callers, see _share.
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def _check_status(method, response):
+    """Raise an exception if `response` status is not a success."""
+    if 200 <= response.status <= 299: return
+    error = Exception("Server responded {}: {}".format(
+        repr(response.status), repr(response.reason)))
+    print("{} failed: {}: {}"
+          .format(method, error.__class__.__name__, str(error)),
+          file=sys.stderr)
+    raise error
+
+def _fetch(method, url, body=None, retry=1, headers=None):
+    """
+    Make a HTTP request at `url` and return response and its data.
+
+    Raise an exception on connection errors, but not on the response status,
+    leaving that for the caller to check. See :func:`_request` for arguments.
+    """
+    print("{} {}".format(method, url))
+    connection = pool.get(url)
+    try:
+        path = _get_path(url)
+        headall = _get_headers(headers)
+        if isinstance(body, str):
+            # UTF-8 is likely to work in most cases,
+            # otherwise caller can encode and give bytes.
+            body = body.encode("utf_8")
+        connection.request(method, path, body, headers=headall)
+        response = connection.getresponse()
+        # Always read response to avoid
+        # http.client.ResponseNotReady: Request-sent.
+        return response, b"".join(_iter_content(response))
+    except Exception as error:
+        if not pool.is_alive(): raise
+        connection.close()
+        broken = tuple(BROKEN_CONNECTION_ERRORS)
+        if not isinstance(error, broken) or retry == 0:
+            name = error.__class__.__name__
+            print("{} failed: {}: {}"
+                  .format(method, name, str(error)),
+                  file=sys.stderr)
+            raise # Exception
+        # If we haven't successfully returned a response,
+        # nor reraised an Exception, we move on to try again.
+        assert retry > 0
+    finally:
+        pool.put(url, connection)
+    return _fetch(method, url, body, retry-1, headers)
 
+def get(url, encoding=None, retry=1, headers=None, cache=False, stale=False):
+    """
+    Make a HTTP GET request at `url` and return response.
 
-def get(url, encoding=None, retry=1, headers=None):
-    """Make a HTTP GET request at `url` and return response."""
+    If `cache` is ``True``, use the on-disk :attr:`http.response_cache`.
+    If also `stale` is ``True``, allow returning stale data from the cache
+    while revalidating it in the background.
+    """
     return _request("GET",
                     url,
                     body=None,
                     encoding=encoding,
                     retry=retry,
-                    headers=headers)
+                    headers=headers,
+                    cache=cache,
+                    stale=stale)
+
+def get_chunks(url, size=65536, headers=None):
+    """
+    Make a HTTP GET request at `url` and yield response in chunks.
+
+    Chunks are bytes of at most `size` bytes, decompressed if the server
+    compressed the response. This allows processing large responses
+    incrementally as data arrives, without holding all of it in memory.
+    No retries are done, since data might have been consumed.
+    """
+    print("GET {}".format(url))
+    connection = pool.get(url)
+    complete = False
+    try:
+        connection.request("GET", _get_path(url), headers=_get_headers(headers))
+        response = connection.getresponse()
+        if not 200 <= response.status <= 299:
+            response.read()
+            raise Exception("Server responded {}: {}".format(
+                repr(response.status), repr(response.reason)))
+        yield from _iter_content(response, size)
+        complete = True
+    except Exception as error:
+        name = error.__class__.__name__
+        print("GET failed: {}: {}"
+              .format(name, str(error)),
+              file=sys.stderr)
+        raise # Exception
+    finally:
+        if not complete:
+            # If the caller stopped iterating or we failed, the response
+            # was not fully read and the connection cannot be reused.
+            with htl.util.silent(Exception):
+                connection.close()
+        pool.put(url, connection)
+
+def _get_decompressor(response):
+    """Return a decompressor for data of `response` or ``None``."""
+    encoding = response.getheader("Content-Encoding", "").strip().lower()
+    if encoding in ("gzip", "x-gzip"):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        return zlib.decompressobj()
+    return None
+
+def _get_headers(headers=None):
+    """Return default headers updated with `headers`."""
+    headall = HEADERS.copy()
+    headall.update(headers or {})
+    return headall
+
+def get_json(url, encoding="utf_8", retry=1, headers=None, cache=False, stale=False):
+    """
+    Make a HTTP GET request at `url` and return response parsed as JSON.
 
-def get_json(url, encoding="utf_8", retry=1, headers=None):
-    """Make a HTTP GET request at `url` and return response parsed as JSON."""
+    See :func:`get` for `cache` and `stale`.
+    """
     return _request_json("GET",
                          url,
                          body=None,
                          encoding=encoding,
                          retry=retry,
-                         headers=headers)
+                         headers=headers,
+                         cache=cache,
+                         stale=stale)
+
+def get_json_many(urls, encoding="utf_8", retry=1, headers=None, cache=False):
+    """
+    Make HTTP GET requests at `urls` in parallel and return parsed responses.
+
+    Return a list of responses parsed as JSON in the same order as `urls`,
+    with the exception raised in place of the response for requests that
+    failed. See :func:`get` for other arguments.
+    """
+    return _map(get_json,
+                urls,
+                encoding=encoding,
+                retry=retry,
+                headers=headers,
+                cache=cache)
+
+def get_many(urls, encoding=None, retry=1, headers=None, cache=False):
+    """
+    Make HTTP GET requests at `urls` in parallel and return responses.
+
+    Return a list of responses in the same order as `urls`, with the exception
+    raised in place of the response for requests that failed. See :func:`get`
+    for other arguments.
+    """
+    return _map(get,
+                urls,
+                encoding=encoding,
+                retry=retry,
+                headers=headers,
+                cache=cache)
+
+def _get_path(url):
+    """Return `url` without scheme and netloc."""
+    # Do relative requests (without scheme and netloc)
+    # for better compatibility with different servers.
+    components = urllib.parse.urlparse(url)
+    components = ("", "") + components[2:]
+    return urllib.parse.urlunparse(components)
+
+def _iter_content(response, size=65536):
+    """Yield data of `response` in chunks, decompressing as needed."""
+    decompressor = _get_decompressor(response)
+    first = True
+    while True:
+        blob = response.read(size)
+        if not blob: break
+        if decompressor is not None:
+            # Limit output to avoid a small chunk of highly
+            # compressed data blowing up in memory at once.
+            try:
+                blob = decompressor.decompress(blob, size)
+            except zlib.error:
+                # Servers often send "deflate" as raw deflate data without
+                # the zlib wrapper, in which case the header doesn't check.
+                encoding = response.getheader("Content-Encoding", "")
+                if not first or encoding.strip().lower() != "deflate": raise
+                decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+                blob = decompressor.decompress(blob, size)
+            first = False
+            while blob:
+                yield blob
+                blob = decompressor.decompress(decompressor.unconsumed_tail, size)
+            continue
+        yield blob
+    if decompressor is not None:
+        blob = decompressor.flush()
+        if blob: yield blob
+
+def _map(function, urls, **kwargs):
+    """Call `function` for each of `urls` in parallel and return results."""
+    urls = list(urls)
+    if not urls: return []
+    def call(url):
+        try:
+            return function(url, **kwargs)
+        except Exception as error:
+            return error
+    # Requests to the same host wait for a free connection in the pool,
+    # so there's no use in running more workers than there are slots.
+    workers = min(len(urls), pool.get_capacity(urls))
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        return list(executor.map(call, urls))
 
 def post(url, body, encoding=None, retry=1, headers=None):
     """Make a HTTP POST request at `url` and return response."""
@@ -169,7 +676,8 @@ def post_json(url, body, encoding="utf_8", retry=1, headers=None):
                          retry=retry,
                          headers=headers)
 
-def _request(method, url, body=None, encoding=None, retry=1, headers=None):
+def _request(method, url, body=None, encoding=None, retry=1, headers=None,
+             cache=False, stale=False):
     """
     Make a HTTP request at `url` using `method`.
 
@@ -179,51 +687,30 @@ def _request(method, url, body=None, encoding=None, retry=1, headers=None):
     If `encoding` is ``None``, return bytes, otherwise decode response data to
     text using `encoding`. Try again `retry` times in some particular cases
     that imply a connection error. `headers` should be a dictionary of custom
-    headers to add to the defaults :attr:`http.HEADERS`.
+    headers to add to the defaults :attr:`http.HEADERS`. See :func:`get` for
+    `cache` and `stale`, which only apply to GET requests.
     """
-    print("{} {}".format(method, url))
-    try:
-        connection = pool.get(url)
-        # Do relative requests (without scheme and netloc)
-        # for better compatibility with different servers.
-        components = urllib.parse.urlparse(url)
-        components = ("", "") + components[2:]
-        path = urllib.parse.urlunparse(components)
-        headall = HEADERS.copy()
-        headall.update(headers or {})
-        if isinstance(body, str):
-            # UTF-8 is likely to work in most cases,
-            # otherwise caller can encode and give bytes.
-            body = body.encode("utf_8")
-        connection.request(method, path, body, headers=headall)
-        response = connection.getresponse()
-        # Always read response to avoid
-        # http.client.ResponseNotReady: Request-sent.
-        blob = response.read()
-        if not 200 <= response.status <= 299:
-            raise Exception("Server responded {}: {}".format(
-                repr(response.status), repr(response.reason)))
-        if encoding is None: return blob
-        return blob.decode(encoding, errors="replace")
-    except Exception as error:
-        if not pool.is_alive(): raise
-        connection.close()
-        connection = None
-        broken = tuple(BROKEN_CONNECTION_ERRORS)
-        if not isinstance(error, broken) or retry == 0:
-            name = error.__class__.__name__
-            print("{} failed: {}: {}"
-                  .format(method, name, str(error)),
-                  file=sys.stderr)
-            raise # Exception
-        # If we haven't successfully returned a response,
-        # nor reraised an Exception, we move on to try again.
-        assert retry > 0
-    finally:
-        pool.put(url, connection)
-    return _request(method, url, body, encoding, retry-1, headers)
+    args = (method, url, body, retry, headers, cache, stale)
+    if method == "GET":
+        # Let concurrent identical requests share one response.
+        key = (url, repr(sorted((headers or {}).items())), cache, stale)
+        blob = _share(key, _request_data, *args)
+    else:
+        blob = _request_data(*args)
+    if encoding is None: return blob
+    return blob.decode(encoding, errors="replace")
 
-def _request_json(method, url, body=None, encoding="utf_8", retry=1, headers=None):
+def _request_data(method, url, body=None, retry=1, headers=None,
+                  cache=False, stale=False):
+    """Make a HTTP request at `url` and return response data as bytes."""
+    if cache and method == "GET":
+        return response_cache.get(url, retry, headers, stale)
+    response, blob = _fetch(method, url, body, retry, headers)
+    _check_status(method, response)
+    return blob
+
+def _request_json(method, url, body=None, encoding="utf_8", retry=1, headers=None,
+                  cache=False, stale=False):
     """
     Make a HTTP request, return response parsed as JSON.
 
@@ -233,9 +720,10 @@ def _request_json(method, url, body=None, encoding="utf_8", retry=1, headers=Non
     If `encoding` is ``None``, return bytes, otherwise decode response data to
     text using `encoding`. Try again `retry` times in some particular cases
     that imply a connection error. `headers` should be a dictionary of custom
-    headers to add to the defaults :attr:`http.HEADERS`.
+    headers to add to the defaults :attr:`http.HEADERS`. See :func:`get` for
+    `cache` and `stale`, which only apply to GET requests.
     """
-    text = _request(method, url, body, encoding, retry, headers)
+    text = _request(method, url, body, encoding, retry, headers, cache, stale)
     if not text.strip() and retry > 0:
         # A blank return is probably an error.
         pool.reset(url)
@@ -250,3 +738,31 @@ def _request_json(method, url, body=None, encoding="utf_8", retry=1, headers=Non
               .format(name, str(error)),
               file=sys.stderr)
         raise # Exception
+
+def _share(key, function, *args):
+    """
+    Call `function` with `args` and return its return value.
+
+    If a call with the same `key` is already in progress, wait for it to
+    finish and return its return value, or raise its exception, instead of
+    making another call. Count such shared calls in :attr:`http.stats`.
+    """
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = concurrent.futures.Future()
+        else:
+            stats["coalesced"] += 1
+    if not leader:
+        return flight.result()
+    try:
+        value = function(*args)
+        flight.set_result(value)
+        return value
+    except Exception as error:
+        flight.set_exception(error)
+        raise # Exception
+    finally:
+        with _flights_lock:
+            del _flights[key]
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 Osmo Salomaa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Fast extraction of fields from JSON messages."""
+
+import functools
+import json
+import re
+
+NULLS = (b"null", "null")
+NUMBER = r"-?[0-9]+(?:\.[0-9]+)?(?:[eE][-+]?[0-9]+)?|null"
+
+RE_KEY = re.compile(rb'\s*,?\s*("(?:[^"\\]|\\.)*")\s*:\s*')
+RE_SCALAR = re.compile(rb'("(?:[^"\\]|\\.)*"|[^\s,}\]]+)\s*[,}\]]')
+RE_STRING = re.compile(rb'"(?:[^"\\]|\\.)*"')
+RE_STRUCTURE = re.compile(rb'["{}\[\]]')
+
+
+def extract(blob, keys, root=None):
+    """
+    Return a dictionary of values of `keys` in JSON `blob`.
+
+    `blob` should be a JSON object, as ``str``, ``bytes`` or ``memoryview``,
+    with `keys` found in the object itself or in the object found under key
+    `root`. Scan for numeric values of `keys` without decoding the whole
+    `blob`, returning numbers as floats and nulls as ``None``. On anything
+    unusual, e.g. a missing or repeated key or a non-numeric value, fall back
+    on decoding the whole `blob` with :func:`json.loads`, in which case
+    values are returned as decoded and missing keys as ``None``.
+    """
+    tokens = scan(blob, keys)
+    if tokens is None:
+        return _extract_json(blob, keys, root)
+    return parse_tokens(tokens)
+
+def _extract_json(blob, keys, root=None):
+    """Return a dictionary of values of `keys` in JSON `blob`."""
+    if isinstance(blob, (bytes, bytearray, memoryview)):
+        blob = str(blob, "utf_8", errors="replace")
+    data = json.loads(blob)
+    if root is not None:
+        data = data[root]
+    return {k: data.get(k) for k in keys}
+
+@functools.lru_cache(maxsize=32)
+def _get_scanner(keys, binary):
+    """Return a regular expression to find numeric values of `keys`."""
+    pattern = r'"({})"\s*:\s*({})'.format("|".join(map(re.escape, keys)), NUMBER)
+    if not binary:
+        return re.compile(pattern), {k: k for k in keys}
+    return (re.compile(pattern.encode("ascii")),
+            {k.encode("ascii"): k for k in keys})
+
+def iterobject(chunks, keep=None):
+    """
+    Parse a JSON object incrementally from `chunks` of bytes.
+
+    Yield tuples of key and the value's JSON as bytes for each member of the
+    top-level object, for which calling `keep` with the key returns ``True``,
+    or all members if `keep` is ``None``. Values of other members are skipped
+    without decoding. Only as much data is held in memory at a time as it
+    takes to hold one member.
+    """
+    buffer = b""
+    chunks = iter(chunks)
+    pos = -1
+    for chunk in chunks:
+        buffer += chunk
+        if pos < 0:
+            # Skip to after the opening brace of the object.
+            start = buffer.find(b"{")
+            if start < 0: continue
+            pos = start + 1
+        while True:
+            key = RE_KEY.match(buffer, pos)
+            if key is None: break
+            end = _find_value_end(buffer, key.end())
+            if end is None: break
+            name = key.group(1)
+            name = (name[1:-1].decode("utf_8")
+                    if not b"\\" in name else json.loads(name.decode("utf_8")))
+            if keep is None or keep(name):
+                yield name, buffer[key.end():end]
+            pos = end
+        # Drop processed data to keep memory use down.
+        buffer = buffer[pos:]
+        pos = 0
+
+def _find_value_end(buffer, pos):
+    """Return the end of JSON value at `pos` or ``None`` if incomplete."""
+    if pos >= len(buffer):
+        return None
+    if buffer[pos:pos+1] == b'"':
+        # Don't let the scalar pattern match part of a string
+        # that continues in chunks not yet received.
+        match = RE_STRING.match(buffer, pos)
+        if match is None: return None
+        return match.end()
+    if not buffer[pos:pos+1] in (b"{", b"["):
+        match = RE_SCALAR.match(buffer, pos)
+        if match is None: return None
+        return match.end(1)
+    depth = 0
+    while True:
+        # Go through structural characters, skipping over strings,
+        # which can contain anything, until the value is closed.
+        match = RE_STRUCTURE.search(buffer, pos)
+        if match is None: return None
+        char = match.group()
+        if char == b'"':
+            match = RE_STRING.match(buffer, match.start())
+            if match is None: return None
+            pos = match.end()
+            continue
+        depth += 1 if char in (b"{", b"[") else -1
+        pos = match.end()
+        if depth == 0:
+            return pos
+
+def parse_tokens(tokens):
+    """Return a dictionary of values of raw `tokens` from :func:`scan`."""
+    return {k: (None if v in NULLS else float(v)) for k, v in tokens.items()}
+
+def scan(blob, keys):
+    """
+    Return a dictionary of raw tokens of `keys` in JSON `blob` or ``None``.
+
+    Tokens are the numeric values of `keys` as they appear in `blob`, which
+    allows e.g. checking for changes without parsing. Return ``None`` if the
+    fast scan is not applicable, see :func:`extract`.
+    """
+    binary = isinstance(blob, (bytes, bytearray, memoryview))
+    pattern, names = _get_scanner(tuple(keys), binary)
+    matches = pattern.findall(blob)
+    tokens = dict(matches)
+    # Require each key exactly once, otherwise
+    # the data is not what we expect it to be.
+    if not len(matches) == len(tokens) == len(names): return None
+    return {names[k]: v for k, v in tokens.items()}
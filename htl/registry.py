@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 Osmo Salomaa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compact storage of the last known state of vehicles."""
+
+import array
+import htl
+import math
+import threading
+import time
+
+__all__ = ("VehicleRegistry",)
+
+# math.nan is not available before Python 3.5.
+NAN = float("nan")
+
+
+class VehicleRegistry:
+
+    """
+    Compact storage of the last known state of vehicles.
+
+    Vehicles are stored in parallel arrays, one slot per vehicle, with an
+    index from vehicle id to slot. Slots of removed vehicles are reused, so
+    that memory use follows the peak amount of vehicles tracked.
+    """
+
+    def __init__(self):
+        """Initialize a :class:`VehicleRegistry` instance."""
+        self._bearing = array.array("d")
+        self._code = []
+        self._free = []
+        self._id = []
+        self._index = {}
+        self._line = []
+        self._lock = threading.RLock()
+        self._timestamp = array.array("d")
+        self._type = []
+        self._utime = array.array("d")
+        self._x = array.array("d")
+        self._y = array.array("d")
+
+    @htl.util.locked_method
+    def __contains__(self, id):
+        """Return ``True`` if vehicle `id` is in registry."""
+        return id in self._index
+
+    @htl.util.locked_method
+    def __len__(self):
+        """Return the amount of vehicles in registry."""
+        return len(self._index)
+
+    @htl.util.locked_method
+    def dump(self):
+        """
+        Return a list of vehicles as rows for :meth:`load`.
+
+        Rows are lists of id, code, line, type, x, y, bearing, time of update
+        and timestamp, with missing bearing and timestamp as ``None``.
+        """
+        nan = lambda x: None if math.isnan(x) else x
+        return [[self._id[slot],
+                 self._code[slot],
+                 self._line[slot],
+                 self._type[slot],
+                 self._x[slot],
+                 self._y[slot],
+                 nan(self._bearing[slot]),
+                 self._utime[slot],
+                 nan(self._timestamp[slot])]
+                for slot in self._index.values()]
+
+    @htl.util.locked_method
+    def get(self, id):
+        """Return vehicle `id` as a dictionary or ``None``."""
+        slot = self._index.get(id)
+        if slot is None: return None
+        vehicle = {
+            "id":   self._id[slot],
+            "code": self._code[slot],
+            "line": self._line[slot],
+            "type": self._type[slot],
+            "x":    self._x[slot],
+            "y":    self._y[slot],
+        }
+        if not math.isnan(self._bearing[slot]):
+            vehicle["bearing"] = self._bearing[slot]
+        return vehicle
+
+    @htl.util.locked_method
+    def get_timestamp(self, id):
+        """Return timestamp of position of vehicle `id` or ``None``."""
+        slot = self._index.get(id)
+        if slot is None: return None
+        if math.isnan(self._timestamp[slot]): return None
+        return self._timestamp[slot]
+
+    @htl.util.locked_method
+    def get_utime(self, id):
+        """Return the time vehicle `id` was last updated or ``None``."""
+        slot = self._index.get(id)
+        if slot is None: return None
+        return self._utime[slot]
+
+    @htl.util.locked_method
+    def ids(self):
+        """Return a list of ids of vehicles in registry."""
+        return list(self._index)
+
+    @htl.util.locked_method
+    def load(self, rows, max_age=None):
+        """
+        Add vehicles from `rows` as returned by :meth:`dump`.
+
+        Skip vehicles last updated more than `max_age` seconds ago and ones
+        already in registry. Return a list of ids of vehicles added.
+        """
+        ids = []
+        now = time.time()
+        for id, code, line, type, x, y, bearing, utime, timestamp in rows:
+            if max_age is not None and now - utime > max_age: continue
+            if id in self._index: continue
+            vehicle = dict(id=id, code=code, line=line, type=type, x=x, y=y)
+            if bearing is not None:
+                vehicle["bearing"] = bearing
+            self.update(vehicle, utime=utime, timestamp=timestamp)
+            ids.append(id)
+        return ids
+
+    @htl.util.locked_method
+    def remove(self, id, before=None):
+        """
+        Remove vehicle `id` from registry.
+
+        If `before` is given, remove only if last updated before it.
+        Return ``True`` if removed, ``False`` if not.
+        """
+        slot = self._index.get(id)
+        if slot is None: return False
+        if before is not None and self._utime[slot] > before: return False
+        del self._index[id]
+        # Release references to strings held,
+        # keep the slot around for reuse.
+        self._id[slot] = self._code[slot] = None
+        self._line[slot] = self._type[slot] = None
+        self._free.append(slot)
+        return True
+
+    @htl.util.locked_method
+    def touch(self, id, utime=None):
+        """Mark vehicle `id` updated, return ``False`` if not found."""
+        slot = self._index.get(id)
+        if slot is None: return False
+        self._utime[slot] = time.time() if utime is None else utime
+        return True
+
+    @htl.util.locked_method
+    def update(self, vehicle, utime=None, timestamp=None):
+        """
+        Add or update `vehicle` and return its slot.
+
+        `utime` is the time the update was received, `timestamp` the time
+        the position was recorded as reported by the vehicle, if available.
+        """
+        id = vehicle["id"]
+        slot = self._index.get(id)
+        if slot is None:
+            slot = self._allocate()
+            self._index[id] = slot
+        self._id[slot] = id
+        self._code[slot] = vehicle["code"]
+        self._line[slot] = vehicle["line"]
+        self._type[slot] = vehicle["type"]
+        self._x[slot] = vehicle["x"]
+        self._y[slot] = vehicle["y"]
+        self._bearing[slot] = vehicle.get("bearing", NAN)
+        self._utime[slot] = time.time() if utime is None else utime
+        self._timestamp[slot] = NAN if timestamp is None else timestamp
+        return slot
+
+    def _allocate(self):
+        """Return a free slot, growing arrays if needed."""
+        if self._free:
+            return self._free.pop()
+        for column in (self._code,
+                       self._id,
+                       self._line,
+                       self._type):
+            column.append(None)
+        for column in (self._bearing,
+                       self._timestamp,
+                       self._utime,
+                       self._x,
+                       self._y):
+            column.append(NAN)
+        return len(self._id) - 1
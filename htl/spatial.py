@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 Osmo Salomaa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Uniform grid index of vehicle positions."""
+
+import htl
+import math
+import threading
+
+__all__ = ("SpatialIndex",)
+
+
+class SpatialIndex:
+
+    """Uniform grid index of vehicle positions."""
+
+    def __init__(self, size=0.01):
+        """
+        Initialize a :class:`SpatialIndex` instance.
+
+        `size` is the width and height of grid cells in degrees.
+        """
+        self.size = size
+        self._cells = {}
+        self._index = {}
+        self._lock = threading.Lock()
+
+    def _get_cell(self, x, y):
+        """Return grid cell for coordinates `x`, `y`."""
+        return (math.floor(x / self.size), math.floor(y / self.size))
+
+    @htl.util.locked_method
+    def query(self, bbox):
+        """Return a set of ids of vehicles in grid cells overlapping `bbox`."""
+        xmin, ymin, xmax, ymax = bbox
+        imin, jmin = self._get_cell(xmin, ymin)
+        imax, jmax = self._get_cell(xmax, ymax)
+        ids = set()
+        if (imax - imin + 1) * (jmax - jmin + 1) > len(self._cells):
+            # If zoomed out far, it's faster to go through
+            # the cells that exist than the ones in range.
+            cells = [x for x in self._cells
+                     if imin <= x[0] <= imax and jmin <= x[1] <= jmax]
+        else:
+            cells = [(i, j)
+                     for i in range(imin, imax + 1)
+                     for j in range(jmin, jmax + 1)]
+        for cell in cells:
+            ids.update(self._cells.get(cell, ()))
+        return ids
+
+    @htl.util.locked_method
+    def remove(self, id):
+        """Remove vehicle `id` from index."""
+        cell = self._index.pop(id, None)
+        if cell is None: return
+        self._cells[cell].discard(id)
+        if not self._cells[cell]:
+            del self._cells[cell]
+
+    @htl.util.locked_method
+    def update(self, id, x, y):
+        """Add or update position of vehicle `id`."""
+        cell = self._get_cell(x, y)
+        prev = self._index.get(id)
+        if prev == cell: return
+        if prev is not None:
+            self._cells[prev].discard(id)
+            if not self._cells[prev]:
+                del self._cells[prev]
+        self._cells.setdefault(cell, set()).add(id)
+        self._index[id] = cell
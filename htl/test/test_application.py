@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 Osmo Salomaa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import htl.test
+import os
+import tempfile
+import time
+
+
+class TestApplication(htl.test.TestCase):
+
+    def setup_method(self, method):
+        self.app = htl.Application(ttl=180, margin=0, max_age=600)
+        self.app._snapshot_path = os.path.join(
+            tempfile.mkdtemp(), "vehicles.json")
+        self.vehicle = dict(id="12/1234",
+                            code="1065",
+                            line="65",
+                            type="bus",
+                            x=24.94,
+                            y=60.17)
+
+    def write_snapshot(self, *ages):
+        now = time.time()
+        rows = [[str(i), "1065", "65", "bus", 24.94, 60.17, None, now - age,
+                 None] for i, age in enumerate(ages)]
+        htl.util.write_json(dict(version=htl.application.SNAPSHOT_VERSION,
+                                 vehicles=rows),
+                            self.app._snapshot_path)
+
+    def test__read_snapshot(self):
+        self.write_snapshot(60, 500, 900)
+        self.app._read_snapshot()
+        assert len(self.app.registry) == 2
+        assert self.app._dispatcher._pending["0"]["provisional"]
+        assert set(self.app._dispatcher._pending) == set(("0", "1"))
+
+    def test__read_snapshot__deadline(self):
+        self.write_snapshot(60, 500)
+        self.app._read_snapshot()
+        now = time.time()
+        deadlines = self.app._expiry._deadlines
+        # A fresh ttl from load, but at most max_age since the last update.
+        assert abs(deadlines["0"] - (now + 180)) < 1
+        assert abs(deadlines["1"] - (now + 100)) < 1
+
+    def test__read_snapshot__expire(self):
+        self.write_snapshot(500)
+        self.app._read_snapshot()
+        self.app._expire_vehicle("0")
+        assert len(self.app.registry) == 0
+
+    def test__read_snapshot__version(self):
+        htl.util.write_json(dict(version=0, vehicles=[]),
+                            self.app._snapshot_path)
+        self.app._read_snapshot()
+        assert len(self.app.registry) == 0
+
+    def test__update_vehicle(self):
+        self.app._update_vehicle(self.vehicle, timestamp=100)
+        assert "12/1234" in self.app.registry
+        assert "12/1234" in self.app._dispatcher._pending
+
+    def test__update_vehicle__culled(self):
+        self.app.set_viewport((25.0, 60.0, 25.1, 60.1))
+        self.app._update_vehicle(self.vehicle)
+        assert "12/1234" in self.app.registry
+        assert not self.app._dispatcher._pending
+        self.app.set_viewport((24.9, 60.1, 25.0, 60.2))
+        assert "12/1234" in self.app._dispatcher._pending
+
+    def test__update_vehicle__stale(self):
+        self.app._update_vehicle(self.vehicle, timestamp=100)
+        vehicle = dict(self.vehicle, x=25.0)
+        self.app._update_vehicle(vehicle, timestamp=99)
+        assert self.app.registry.get("12/1234")["x"] == 24.94
+        assert self.app.get_stats()["stale"] == 1
+
+    def test__write_snapshot(self):
+        self.app._update_vehicle(self.vehicle)
+        self.app._write_snapshot()
+        app = htl.Application()
+        app._snapshot_path = self.app._snapshot_path
+        app._read_snapshot()
+        assert "12/1234" in app.registry
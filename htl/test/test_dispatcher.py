@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 Osmo Salomaa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import htl.test
+import time
+
+
+class TestDispatcher(htl.test.TestCase):
+
+    def setup_method(self, method):
+        self.dispatcher = htl.Dispatcher(interval=0.1, window=0.5)
+        self.sent = []
+        self.send = htl.dispatcher.pyotherside.send
+        htl.dispatcher.pyotherside.send = lambda *args: self.sent.append(args)
+
+    def teardown_method(self, method):
+        self.dispatcher.stop()
+        htl.dispatcher.pyotherside.send = self.send
+
+    def test_flush(self):
+        self.dispatcher.put(dict(id="1", x=1))
+        self.dispatcher.put(dict(id="2", x=2))
+        self.dispatcher.flush()
+        assert len(self.sent) == 1
+        assert self.sent[0][0] == "update-vehicles"
+        assert len(self.sent[0][1]) == 2
+
+    def test_flush__window(self):
+        self.dispatcher.put(dict(id="1", x=1))
+        self.dispatcher.flush()
+        self.dispatcher.put(dict(id="1", x=2))
+        self.dispatcher.put(dict(id="1", x=3))
+        wait = self.dispatcher.flush()
+        assert len(self.sent) == 1
+        assert 0 < wait <= 0.1
+        time.sleep(0.5)
+        self.dispatcher.flush()
+        assert len(self.sent) == 2
+        assert self.sent[1][1] == [dict(id="1", x=3)]
+
+    def test_flush_soon(self):
+        self.dispatcher.interval = 10
+        self.dispatcher.start()
+        self.dispatcher.put(dict(id="1", x=1))
+        self.dispatcher.flush_soon()
+        time.sleep(0.1)
+        assert len(self.sent) == 1
+
+    def test_put(self):
+        self.dispatcher.put(dict(id="1", x=1))
+        self.dispatcher.put(dict(id="1", x=2))
+        self.dispatcher.flush()
+        assert self.sent[0][1] == [dict(id="1", x=2)]
+
+    def test_start(self):
+        self.dispatcher.start()
+        self.dispatcher.put(dict(id="1", x=1))
+        time.sleep(0.3)
+        assert len(self.sent) == 1
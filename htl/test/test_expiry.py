@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 Osmo Salomaa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import htl.test
+import time
+
+
+class TestExpiryScheduler(htl.test.TestCase):
+
+    def setup_method(self, method):
+        self.expired = []
+        self.expiry = htl.ExpiryScheduler(0.2, self.expired.append)
+        self.expiry.start()
+
+    def teardown_method(self, method):
+        self.expiry.stop()
+
+    def test_discard(self):
+        self.expiry.touch("1")
+        self.expiry.discard("1")
+        time.sleep(0.4)
+        assert self.expired == []
+
+    def test_stop(self):
+        self.expiry.touch("1")
+        self.expiry.stop()
+        time.sleep(0.4)
+        assert self.expired == []
+        self.expiry.start()
+        assert self.expired == []
+        time.sleep(0.4)
+        assert self.expired == ["1"]
+
+    def test_touch(self):
+        self.expiry.touch("1")
+        self.expiry.touch("2")
+        time.sleep(0.1)
+        self.expiry.touch("1")
+        time.sleep(0.15)
+        assert self.expired == ["2"]
+        time.sleep(0.2)
+        assert self.expired == ["2", "1"]
+
+    def test_touch__utime(self):
+        self.expiry.touch("1", time.time() - 0.15)
+        self.expiry.touch("2")
+        time.sleep(0.1)
+        assert self.expired == ["1"]
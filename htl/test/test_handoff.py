@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 Osmo Salomaa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import htl.test
+import time
+
+
+class TestHandoff(htl.test.TestCase):
+
+    def setup_method(self, method):
+        self.done = []
+        self.handoff = htl.Handoff(self.done.append, size=3)
+
+    def teardown_method(self, method):
+        self.handoff.stop()
+
+    def test___init____policy(self):
+        self.assert_raises(ValueError, htl.Handoff, None, policy="xxx")
+
+    def test_put__coalesce(self):
+        self.handoff.put("1", "1a")
+        self.handoff.put("2", "2a")
+        self.handoff.put("1", "1b")
+        self.handoff.start()
+        time.sleep(0.1)
+        assert self.done == ["1b", "2a"]
+        assert self.handoff.stats["coalesced"] == 1
+
+    def test_put__drop_oldest(self):
+        self.handoff.policy = "drop-oldest"
+        self.handoff.put("1", "1a")
+        self.handoff.put("2", "2a")
+        self.handoff.put("1", "1b")
+        self.handoff.start()
+        time.sleep(0.1)
+        assert self.done == ["2a", "1b"]
+
+    def test_put__order(self):
+        self.handoff.put("1", "1b", order=2)
+        self.handoff.put("1", "1a", order=1)
+        self.handoff.start()
+        time.sleep(0.1)
+        assert self.done == ["1b"]
+        assert self.handoff.stats["stale"] == 1
+
+    def test_put__overflow(self):
+        for i in range(5):
+            self.handoff.put(str(i), str(i))
+        self.handoff.start()
+        time.sleep(0.1)
+        assert self.done == ["2", "3", "4"]
+        assert self.handoff.stats["dropped"] == 2
+
+    def test_stop(self):
+        self.handoff.start()
+        self.handoff.stop()
+        self.handoff.put("1", "1a")
+        time.sleep(0.1)
+        assert self.done == []
+        self.handoff.start()
+        time.sleep(0.1)
+        assert self.done == ["1a"]
@@ -15,9 +15,79 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import gzip
 import htl.test
+import http.server
+import json
+import socket
+import socketserver
+import tempfile
 import threading
 import time
+import zlib
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        time.sleep(self.server.delay)
+        if self.headers.get("If-None-Match") == self.server.etag:
+            self.send_response(304)
+            self.send_header("ETag", self.server.etag)
+            self.end_headers()
+            return
+        blob = self.server.blob
+        encoding = self.server.encoding
+        accept = self.headers.get("Accept-Encoding", "")
+        if encoding == "gzip" and "gzip" in accept:
+            blob = gzip.compress(blob)
+        elif encoding == "deflate" and "deflate" in accept:
+            blob = zlib.compress(blob)
+        elif encoding == "raw-deflate" and "deflate" in accept:
+            compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+            blob = compressor.compress(blob) + compressor.flush()
+            encoding = "deflate"
+        else:
+            encoding = None
+        self.send_response(200)
+        self.send_header("Cache-Control", self.server.cache_control)
+        self.send_header("Content-Length", str(len(blob)))
+        if encoding is not None:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("ETag", self.server.etag)
+        self.end_headers()
+        self.server.sent += len(blob)
+        if self.server.rate is None:
+            return self.wfile.write(blob)
+        # Throttle to rate bytes per second to simulate a slow network.
+        for i in range(0, len(blob), 65536):
+            chunk = blob[i:i+65536]
+            self.wfile.write(chunk)
+            time.sleep(len(chunk) / self.server.rate)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.blob = b'{"a": 1}'
+        self.cache_control = "max-age=60"
+        self.delay = 0
+        self.encoding = None
+        self.etag = '"1"'
+        self.rate = None
+        self.requests = []
+        self.sent = 0
+        self.url = "http://127.0.0.1:{}/".format(self.server_port)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
 
 
 class TestConnectionPool(htl.test.TestCase):
@@ -54,11 +124,166 @@ class TestConnectionPool(htl.test.TestCase):
         self.pool.terminate()
         time.sleep(3)
 
+    def test_get__fifo(self):
+        order = []
+        connection = self.pool.get(self.http_url)
+        self.pool.get(self.http_url)
+        def get(name):
+            connection = self.pool.get(self.http_url)
+            order.append(name)
+            self.pool.put(self.http_url, connection)
+        threads = []
+        for name in "abcd":
+            threads.append(threading.Thread(target=get, args=(name,)))
+            threads[-1].start()
+            time.sleep(0.05)
+        self.pool.put(self.http_url, connection)
+        for thread in threads:
+            thread.join(1)
+        assert order == list("abcd")
+
+    def test_get__limit(self):
+        self.pool.resize(2, limit=2)
+        self.pool.get(self.http_url)
+        connection = self.pool.get(self.https_url)
+        thread = threading.Thread(target=self.pool.get, args=(self.http_url,))
+        thread.start()
+        thread.join(0.2)
+        assert thread.is_alive()
+        self.pool.put(self.https_url, connection)
+        thread.join(1)
+        assert not thread.is_alive()
+
+    def test_get__reuse(self):
+        server = Server()
+        try:
+            connection = self.pool.get(server.url)
+            connection.request("GET", "/")
+            connection.getresponse().read()
+            self.pool.put(server.url, connection)
+            assert self.pool.get_stats()["idle"] == 1
+            assert self.pool.get(server.url) is connection
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_get__max_idle(self):
+        server = Server()
+        try:
+            self.pool = htl.http.ConnectionPool(2, max_idle=0.1)
+            connection = self.pool.get(server.url)
+            connection.request("GET", "/")
+            connection.getresponse().read()
+            self.pool.put(server.url, connection)
+            time.sleep(0.2)
+            assert self.pool.get(server.url) is not connection
+            assert connection.sock is None
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_get__max_lifetime(self):
+        server = Server()
+        try:
+            self.pool = htl.http.ConnectionPool(2, max_lifetime=0.1)
+            connection = self.pool.get(server.url)
+            connection.request("GET", "/")
+            connection.getresponse().read()
+            time.sleep(0.2)
+            self.pool.put(server.url, connection)
+            assert self.pool.get_stats()["idle"] == 0
+            assert connection.sock is None
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_get__terminate_wakeup(self):
+        self.pool.get(self.http_url)
+        self.pool.get(self.http_url)
+        thread = threading.Thread(target=self.pool.get, args=(self.http_url,))
+        thread.start()
+        thread.join(0.1)
+        start = time.time()
+        self.pool.terminate()
+        thread.join(1)
+        assert not thread.is_alive()
+        assert time.time() - start < 0.5
+
+    def test_get_capacity(self):
+        urls = ["http://a.fi/", "http://a.fi/b", "https://a.fi/", "http://b.fi/"]
+        assert self.pool.get_capacity(urls) == 6
+        self.pool.resize(2, limit=4)
+        assert self.pool.get_capacity(urls) == 4
+
+    def test_get_stats(self):
+        connection = self.pool.get(self.http_url)
+        assert self.pool.get_stats() == dict(idle=0, lent=1, waiting=0)
+        self.pool.put(self.http_url, connection)
+        # Unused connections are not kept.
+        assert self.pool.get_stats() == dict(idle=0, lent=0, waiting=0)
+
     def test_is_alive(self):
         assert self.pool.is_alive()
         self.pool.terminate()
         assert not self.pool.is_alive()
 
+    def test_prewarm(self):
+        server = Server()
+        try:
+            self.pool.prewarm(server.url)
+            time.sleep(0.5)
+            assert self.pool.get_stats()["idle"] == 1
+            self.pool.prewarm(server.url)
+            time.sleep(0.5)
+            assert self.pool.get_stats()["idle"] == 1
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_prewarm__get(self):
+        server = Server()
+        new = self.pool._new
+        def new_slow(url):
+            # Make the handshake take long enough to overlap the get.
+            connection = new(url)
+            connect = connection.connect
+            def connect_slow():
+                time.sleep(0.2)
+                connect()
+            connection.connect = connect_slow
+            return connection
+        self.pool._new = new_slow
+        try:
+            self.pool.prewarm(server.url)
+            # Should wait for and return the prewarmed connection.
+            connection = self.pool.get(server.url)
+            assert connection.sock is not None
+            assert self.pool.get_stats()["idle"] == 0
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_prewarm__max_idle(self):
+        server = Server()
+        try:
+            self.pool = htl.http.ConnectionPool(2, max_idle=0.1)
+            self.pool.prewarm(server.url)
+            time.sleep(0.1)
+            assert self.pool.get_stats()["idle"] == 1
+            # Should be closed without further use of the pool.
+            time.sleep(0.5)
+            assert self.pool.get_stats()["idle"] == 0
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_probe(self):
+        connection = self.pool.get(self.http_url)
+        connection.sock, other = socket.socketpair()
+        assert self.pool._probe(connection)
+        other.close()
+        assert not self.pool._probe(connection)
+
     def test_put(self):
         connection = self.pool.get(self.http_url)
         assert connection is not None
@@ -74,13 +299,91 @@ class TestConnectionPool(htl.test.TestCase):
         connection = self.pool.get(self.http_url)
         assert connection is not None
 
+    def test_resize__grow(self):
+        self.pool.get(self.http_url)
+        self.pool.get(self.http_url)
+        self.pool.resize(3)
+        assert self.pool.get(self.http_url) is not None
+
+    def test_resize__shrink(self):
+        connection1 = self.pool.get(self.http_url)
+        connection2 = self.pool.get(self.http_url)
+        self.pool.resize(1)
+        self.pool.put(self.http_url, connection1)
+        thread = threading.Thread(target=self.pool.get, args=(self.http_url,))
+        thread.start()
+        thread.join(0.2)
+        assert thread.is_alive()
+        self.pool.put(self.http_url, connection2)
+        thread.join(1)
+        assert not thread.is_alive()
+
     def test_terminate(self):
         self.pool.terminate()
         assert not self.pool.is_alive()
 
 
+class TestResponseCache(htl.test.TestCase):
+
+    def setup_method(self, method):
+        self.cache = htl.http.ResponseCache(tempfile.mkdtemp())
+        self.server = Server()
+
+    def teardown_method(self, method):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_get__fresh(self):
+        assert self.cache.get(self.server.url) == self.server.blob
+        assert self.cache.get(self.server.url) == self.server.blob
+        assert len(self.server.requests) == 1
+
+    def test_get__modified(self):
+        self.server.cache_control = "no-cache"
+        self.cache.get(self.server.url)
+        self.server.blob = b'{"a": 2}'
+        self.server.etag = '"2"'
+        assert self.cache.get(self.server.url) == b'{"a": 2}'
+        assert self.server.requests[1]["If-None-Match"] == '"1"'
+
+    def test_get__no_store(self):
+        self.server.cache_control = "no-store"
+        self.cache.get(self.server.url)
+        self.cache.get(self.server.url)
+        assert len(self.server.requests) == 2
+        assert not "If-None-Match" in self.server.requests[1]
+
+    def test_get__not_modified(self):
+        self.server.cache_control = "no-cache"
+        self.cache.get(self.server.url)
+        assert self.cache.get(self.server.url) == self.server.blob
+        assert self.server.requests[1]["If-None-Match"] == '"1"'
+
+    def test_get__stale(self):
+        self.server.cache_control = "no-cache"
+        self.cache.get(self.server.url)
+        self.server.blob = b'{"a": 2}'
+        self.server.etag = '"2"'
+        assert self.cache.get(self.server.url, stale=True) == b'{"a": 1}'
+        time.sleep(0.5)
+        assert self.cache.get(self.server.url, stale=True) == b'{"a": 2}'
+
+
 class TestModule(htl.test.TestCase):
 
+    def setup_method(self, method):
+        self.server = Server()
+        self.server.blob = json.dumps([{
+            "id": "HSL:{:d}".format(i),
+            "longName": "Rautatientori - Kamppi",
+            "mode": "BUS",
+            "shortName": str(i),
+        } for i in range(20000)]).encode("utf_8")
+
+    def teardown_method(self, method):
+        self.server.shutdown()
+        self.server.server_close()
+
     def test_get(self):
         url = "https://otsaloma.io/"
         blob = htl.http.get(url, encoding="utf_8")
@@ -101,3 +404,67 @@ class TestModule(htl.test.TestCase):
     def test_get_json__error(self):
         url = "https://otsaloma.io/pub/test.xml"
         self.assert_raises(Exception, htl.http.get_json, url)
+
+    def test_get__compressed(self):
+        # Compare bytes transferred and wall time for a large JSON body
+        # transferred compressed and uncompressed from a local server
+        # throttled to 2 MB/s.
+        self.server.encoding = "gzip"
+        self.server.rate = 2 * 1024**2
+        start = time.time()
+        blob = htl.http.get(self.server.url,
+                            headers={"Accept-Encoding": "identity"})
+        plain_time = time.time() - start
+        plain_sent = self.server.sent
+        assert blob == self.server.blob
+        start = time.time()
+        blob = htl.http.get(self.server.url)
+        gzip_time = time.time() - start
+        gzip_sent = self.server.sent - plain_sent
+        assert blob == self.server.blob
+        assert gzip_sent < plain_sent / 10
+        assert gzip_time < plain_time / 2
+
+    def test_get__deflate(self):
+        self.server.encoding = "deflate"
+        assert htl.http.get(self.server.url) == self.server.blob
+        assert self.server.sent < len(self.server.blob) / 10
+
+    def test_get__deflate_raw(self):
+        self.server.encoding = "raw-deflate"
+        assert htl.http.get(self.server.url) == self.server.blob
+        assert self.server.sent < len(self.server.blob) / 10
+
+    def test_get_many(self):
+        urls = [self.server.url + str(i) for i in range(8)]
+        urls.insert(3, "http://127.0.0.1:1/")
+        blobs = htl.http.get_many(urls)
+        assert len(blobs) == 9
+        assert isinstance(blobs[3], Exception)
+        del blobs[3]
+        assert all(x == self.server.blob for x in blobs)
+
+    def test_get_json_many(self):
+        self.server.blob = b'{"a": 1}'
+        urls = [self.server.url + str(i) for i in range(8)]
+        assert htl.http.get_json_many(urls) == [{"a": 1}] * 8
+
+    def test_get__coalesce(self):
+        self.server.delay = 0.5
+        coalesced = htl.http.stats["coalesced"]
+        blobs = htl.http.get_many([self.server.url] * 4)
+        assert blobs == [self.server.blob] * 4
+        assert len(self.server.requests) == 1
+        assert htl.http.stats["coalesced"] == coalesced + 3
+
+    def test_get__coalesce_error(self):
+        urls = ["http://127.0.0.1:1/"] * 4
+        blobs = htl.http.get_many(urls)
+        assert all(isinstance(x, Exception) for x in blobs)
+
+    def test_get_chunks__compressed(self):
+        self.server.encoding = "gzip"
+        chunks = list(htl.http.get_chunks(self.server.url, size=1024))
+        assert b"".join(chunks) == self.server.blob
+        assert max(map(len, chunks)) <= 1024
+        assert self.server.sent < len(self.server.blob) / 10
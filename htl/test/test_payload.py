@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 Osmo Salomaa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import htl.test
+import json
+
+PAYLOAD = (b'{"VP":{"desi":"65","dir":"1","oper":12,"veh":1314,'
+           b'"tst":"2018-06-18T11:33:41.519Z","tsi":1529321621,'
+           b'"spd":4.95,"hdg":237,"lat":60.176137,"long":24.938374,'
+           b'"acc":0.21,"dl":-19,"odo":null,"drst":0,"oday":"2018-06-18",'
+           b'"jrn":683,"line":123,"start":"14:33"}}')
+
+KEYS = ("long", "lat", "hdg")
+
+
+class TestModule(htl.test.TestCase):
+
+    def test_extract(self):
+        payload = htl.payload.extract(PAYLOAD, KEYS, root="VP")
+        assert payload == dict(long=24.938374, lat=60.176137, hdg=237.0)
+
+    def test_extract__memoryview(self):
+        payload = htl.payload.extract(memoryview(PAYLOAD), KEYS, root="VP")
+        assert payload == dict(long=24.938374, lat=60.176137, hdg=237.0)
+
+    def test_extract__memoryview_fallback(self):
+        blob = memoryview(PAYLOAD.replace(b'"hdg":237', b'"hdg":"237"'))
+        payload = htl.payload.extract(blob, KEYS, root="VP")
+        assert payload == dict(long=24.938374, lat=60.176137, hdg="237")
+
+    def test_extract__missing(self):
+        blob = PAYLOAD.replace(b'"hdg":237,', b'')
+        payload = htl.payload.extract(blob, KEYS, root="VP")
+        assert payload == dict(long=24.938374, lat=60.176137, hdg=None)
+
+    def test_extract__null(self):
+        payload = htl.payload.extract(PAYLOAD, ("odo",), root="VP")
+        assert payload == dict(odo=None)
+
+    def test_extract__str(self):
+        blob = PAYLOAD.decode("utf_8")
+        payload = htl.payload.extract(blob, KEYS, root="VP")
+        assert payload == dict(long=24.938374, lat=60.176137, hdg=237.0)
+
+    def test_extract__string_value(self):
+        blob = PAYLOAD.replace(b'"hdg":237', b'"hdg":"237"')
+        payload = htl.payload.extract(blob, KEYS, root="VP")
+        assert payload == dict(long=24.938374, lat=60.176137, hdg="237")
+
+    def test_extract__invalid(self):
+        self.assert_raises(ValueError, htl.payload.extract, b"{", KEYS)
+
+    def test_iterobject(self):
+        data = {"/a/1": json.loads(PAYLOAD.decode("utf_8")),
+                "/a/\"2": {"VP": {"desi": "}{][", "x": [1, {"y": 2}]}},
+                "/a/3": None,
+                "/a/4": "x"}
+        blob = json.dumps(data, indent=2).encode("utf_8")
+        for size in (1, 7, 100, len(blob)):
+            chunks = [blob[i:i+size] for i in range(0, len(blob), size)]
+            members = htl.payload.iterobject(chunks)
+            assert {k: json.loads(v.decode("utf_8")) for k, v in members} == data
+
+    def test_iterobject__keep(self):
+        blob = json.dumps({"/a/1": 1, "/b/2": 2, "/a/3": 3}).encode("utf_8")
+        members = htl.payload.iterobject([blob], lambda x: x.startswith("/a/"))
+        assert list(members) == [("/a/1", b"1"), ("/a/3", b"3")]
+
+    def test_iterobject__split_string(self):
+        blob = b'{"a": "x,y", "b": "}]", "c": 1}'
+        for size in range(1, len(blob) + 1):
+            chunks = [blob[i:i+size] for i in range(0, len(blob), size)]
+            members = list(htl.payload.iterobject(chunks))
+            assert members == [("a", b'"x,y"'), ("b", b'"}]"'), ("c", b"1")]
+
+    def test_parse_tokens(self):
+        tokens = htl.payload.scan(PAYLOAD, ("hdg", "odo"))
+        assert htl.payload.parse_tokens(tokens) == dict(hdg=237.0, odo=None)
+
+    def test_scan(self):
+        tokens = htl.payload.scan(PAYLOAD, KEYS)
+        assert tokens == dict(long=b"24.938374", lat=b"60.176137", hdg=b"237")
+
+    def test_scan__repeated(self):
+        blob = PAYLOAD.replace(b'"acc":0.21', b'"lat":0.21')
+        assert htl.payload.scan(blob, KEYS) is None
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 Osmo Salomaa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import htl.test
+import time
+
+
+class TestVehicleRegistry(htl.test.TestCase):
+
+    def setup_method(self, method):
+        self.registry = htl.VehicleRegistry()
+        self.vehicle = dict(id="12/1234",
+                            code="1065",
+                            line="65",
+                            type="bus",
+                            x=24.94,
+                            y=60.17,
+                            bearing=90.0)
+
+    def test___contains__(self):
+        assert not "12/1234" in self.registry
+        self.registry.update(self.vehicle)
+        assert "12/1234" in self.registry
+
+    def test___len__(self):
+        assert len(self.registry) == 0
+        self.registry.update(self.vehicle)
+        self.registry.update(self.vehicle)
+        assert len(self.registry) == 1
+
+    def test_dump(self):
+        self.registry.update(self.vehicle, utime=100, timestamp=99)
+        assert self.registry.dump() == [[
+            "12/1234", "1065", "65", "bus", 24.94, 60.17, 90.0, 100, 99]]
+
+    def test_get(self):
+        self.registry.update(self.vehicle)
+        assert self.registry.get("12/1234") == self.vehicle
+        assert self.registry.get("12/9999") is None
+
+    def test_get__no_bearing(self):
+        del self.vehicle["bearing"]
+        self.registry.update(self.vehicle)
+        assert self.registry.get("12/1234") == self.vehicle
+
+    def test_get_timestamp(self):
+        self.registry.update(self.vehicle)
+        assert self.registry.get_timestamp("12/1234") is None
+        self.registry.update(self.vehicle, timestamp=100)
+        assert self.registry.get_timestamp("12/1234") == 100
+
+    def test_get_utime(self):
+        self.registry.update(self.vehicle, utime=100)
+        assert self.registry.get_utime("12/1234") == 100
+        assert self.registry.get_utime("12/9999") is None
+
+    def test_ids(self):
+        self.registry.update(self.vehicle)
+        assert self.registry.ids() == ["12/1234"]
+
+    def test_load(self):
+        self.registry.update(self.vehicle, utime=time.time())
+        rows = self.registry.dump()
+        self.registry.remove("12/1234")
+        assert self.registry.load(rows) == ["12/1234"]
+        assert self.registry.get("12/1234") == self.vehicle
+        assert self.registry.load(rows) == []
+
+    def test_load__max_age(self):
+        self.registry.update(self.vehicle, utime=time.time() - 100)
+        rows = self.registry.dump()
+        self.registry.remove("12/1234")
+        assert self.registry.load(rows, max_age=60) == []
+
+    def test_remove(self):
+        self.registry.update(self.vehicle)
+        self.registry.remove("12/1234")
+        assert not "12/1234" in self.registry
+        self.registry.remove("12/1234")
+
+    def test_remove__before(self):
+        self.registry.update(self.vehicle, utime=100)
+        assert not self.registry.remove("12/1234", before=50)
+        assert "12/1234" in self.registry
+        assert self.registry.remove("12/1234", before=150)
+        assert not "12/1234" in self.registry
+
+    def test_update__reuse_slot(self):
+        slot = self.registry.update(self.vehicle)
+        self.registry.remove("12/1234")
+        self.vehicle["id"] = "12/5678"
+        assert self.registry.update(self.vehicle) == slot
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 Osmo Salomaa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import htl.test
+
+
+class TestSpatialIndex(htl.test.TestCase):
+
+    def setup_method(self, method):
+        self.index = htl.SpatialIndex(size=0.01)
+        self.index.update("1", 24.941, 60.169)
+        self.index.update("2", 24.951, 60.179)
+        self.index.update("3", 25.500, 60.500)
+
+    def test_query(self):
+        ids = self.index.query((24.90, 60.15, 25.00, 60.20))
+        assert ids == set(("1", "2"))
+
+    def test_query__zoomed_out(self):
+        ids = self.index.query((20.00, 55.00, 30.00, 65.00))
+        assert ids == set(("1", "2", "3"))
+
+    def test_remove(self):
+        self.index.remove("1")
+        self.index.remove("1")
+        ids = self.index.query((24.90, 60.15, 25.00, 60.20))
+        assert ids == set(("2",))
+
+    def test_update(self):
+        self.index.update("3", 24.942, 60.168)
+        ids = self.index.query((24.90, 60.15, 25.00, 60.20))
+        assert ids == set(("1", "2", "3"))
+        ids = self.index.query((25.40, 60.40, 25.60, 60.60))
+        assert ids == set()
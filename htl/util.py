@@ -141,12 +141,21 @@ def type_to_color(type):
         return "#00b9e4"
     return "#007ac9"
 
-def write_json(data, path):
+def write_json(data, path, compact=False):
     """Write `data` to JSON file at `path`."""
     try:
         makedirs(os.path.dirname(path))
         with atomic_open(path, "w", encoding="utf_8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=4, sort_keys=True)
+            if compact:
+                # Skip whitespace for large machine-read files.
+                json.dump(data, f,
+                          ensure_ascii=False,
+                          separators=(",", ":"))
+            else:
+                json.dump(data, f,
+                          ensure_ascii=False,
+                          indent=4,
+                          sort_keys=True)
     except Exception as error:
         print("Failed to write file {}: {}"
               .format(repr(path), str(error)),
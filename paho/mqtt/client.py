@@ -34,6 +34,9 @@ import struct
 import sys
 import threading
 import time
+
+from .matcher import MQTTMatcher
+
 HAVE_DNS = True
 try:
     import dns.resolver
@@ -84,6 +87,7 @@ MQTT_LOG_NOTICE = 0x02
 MQTT_LOG_WARNING = 0x04
 MQTT_LOG_ERR = 0x08
 MQTT_LOG_DEBUG = 0x10
+MQTT_LOG_ALL = 0x1F
 
 # CONNACK codes
 CONNACK_ACCEPTED = 0
@@ -93,6 +97,23 @@ CONNACK_REFUSED_SERVER_UNAVAILABLE = 3
 CONNACK_REFUSED_BAD_USERNAME_PASSWORD = 4
 CONNACK_REFUSED_NOT_AUTHORIZED = 5
 
+_PACKET_NAMES = {
+    CONNECT: "CONNECT",
+    CONNACK: "CONNACK",
+    PUBLISH: "PUBLISH",
+    PUBACK: "PUBACK",
+    PUBREC: "PUBREC",
+    PUBREL: "PUBREL",
+    PUBCOMP: "PUBCOMP",
+    SUBSCRIBE: "SUBSCRIBE",
+    SUBACK: "SUBACK",
+    UNSUBSCRIBE: "UNSUBSCRIBE",
+    UNSUBACK: "UNSUBACK",
+    PINGREQ: "PINGREQ",
+    PINGRESP: "PINGRESP",
+    DISCONNECT: "DISCONNECT",
+}
+
 # Connection state
 mqtt_cs_new = 0
 mqtt_cs_connected = 1
@@ -134,6 +155,26 @@ if sys.version_info[0] < 3:
 else:
     sockpair_data = b"0"
 
+_READ_CHUNK_SIZE = 65536
+
+
+def _decode_remaining_length(buf, pos):
+    """Decode the remaining length field of a packet header at pos in buf.
+
+    Returns a tuple of the remaining length and the position after the field,
+    or None if buf ends before the field does. The length is -1 if the field
+    is longer than the 4 bytes allowed by the protocol."""
+    length = 0
+    for i in range(4):
+        if pos + i >= len(buf):
+            return None
+        byte = buf[pos + i]
+        length += (byte & 127) << (7 * i)
+        if (byte & 128) == 0:
+            return length, pos + i + 1
+    return -1, pos + 4
+
+
 def error_string(mqtt_errno):
     """Return the error string associated with an mqtt error number."""
     if mqtt_errno == MQTT_ERR_SUCCESS:
@@ -233,6 +274,11 @@ def topic_matches_sub(sub, topic):
                 if tpos == tlen and spos == slen:
                     result = True
                     break
+                if tpos == tlen and sub[spos:] == '/#':
+                    # Check for e.g. foo/bar matching foo/+/#
+                    result = True
+                    multilevel_wildcard = True
+                    break
 
             elif sub[spos] == '#':
                 multilevel_wildcard = True
@@ -281,7 +327,9 @@ class MQTTMessage:
     Members:
 
     topic : String. topic that the message was published on.
-    payload : String/bytes the message payload.
+    payload : String/bytes the message payload. With payload_view_set(True),
+      a memoryview for messages with QoS 0 or 1, which is only valid until
+      callbacks return.
     qos : Integer. The message Quality of Service 0, 1 or 2.
     retain : Boolean. If true, the message is a retained message and not fresh.
     mid : Integer. The message id.
@@ -385,6 +433,16 @@ class Client(object):
       to allow debugging. The level variable gives the severity of the message
       and will be one of MQTT_LOG_INFO, MQTT_LOG_NOTICE, MQTT_LOG_WARNING,
       MQTT_LOG_ERR, and MQTT_LOG_DEBUG. The message itself is in buf.
+      Messages are only formatted for levels enabled with log_levels_set(),
+      all levels by default.
+
+    on_trace(client, userdata, event): called for each packet sent or received
+      when defined, which can be done at any time to start tracing. The event
+      variable is a dictionary with keys "direction" ("in" or "out"), "type"
+      (packet type name, e.g. "PUBLISH"), "size" (bytes including the fixed
+      header), "time" (when handling or queueing of the packet started) and
+      "duration" (seconds spent handling an incoming packet or from queueing
+      an outgoing packet until it was completely written).
 
     """
     def __init__(self, client_id="", clean_session=True, userdata=None, protocol=MQTTv31):
@@ -440,6 +498,7 @@ class Client(object):
             "packet": b"",
             "to_process": 0,
             "pos": 0}
+        self._in_buffer = bytearray()
         self._out_packet = []
         self._current_out_packet = None
         self._last_msg_in = time.time()
@@ -450,6 +509,12 @@ class Client(object):
         self._out_messages = []
         self._in_messages = []
         self._max_inflight_messages = 20
+        self._read_budget = 0.1
+        self._thread_max_packets = 1
+        self._message_reuse = False
+        self._in_message_reused = MQTTMessage()
+        self._payload_view = False
+        self._log_levels = MQTT_LOG_ALL
         self._inflight_messages = 0
         self._will = False
         self._will_topic = ""
@@ -460,10 +525,12 @@ class Client(object):
         self.on_connect = None
         self.on_publish = None
         self.on_message = None
-        self.on_message_filtered = []
+        self._on_message_filtered = MQTTMatcher()
+        self._on_message_filtered_count = 0
         self.on_subscribe = None
         self.on_unsubscribe = None
         self.on_log = None
+        self.on_trace = None
         self._host = ""
         self._port = 1883
         self._bind_address = ""
@@ -698,6 +765,7 @@ class Client(object):
             "packet": b"",
             "to_process": 0,
             "pos": 0}
+        self._in_buffer = bytearray()
 
         self._out_packet_mutex.acquire()
         self._out_packet = []
@@ -771,7 +839,8 @@ class Client(object):
 
         timeout: The time in seconds to wait for incoming/outgoing network
           traffic before timing out and returning.
-        max_packets: Not currently used.
+        max_packets: The maximum number of incoming packets to handle, or 0 to
+          handle as many as are readable. See loop_read().
 
         Returns MQTT_ERR_SUCCESS on success.
         Returns >0 on error.
@@ -780,6 +849,12 @@ class Client(object):
         if timeout < 0.0:
             raise ValueError('Invalid timeout.')
 
+        # Packets left over in the read buffer from the previous call don't
+        # make the socket readable, so don't wait for it to become readable.
+        buffered = self._packet_buffered()
+        if buffered:
+            timeout = 0.0
+
         self._current_out_packet_mutex.acquire()
         self._out_packet_mutex.acquire()
         if self._current_out_packet is None and len(self._out_packet) > 0:
@@ -807,7 +882,7 @@ class Client(object):
         except:
             return MQTT_ERR_UNKNOWN
 
-        if self.socket() in socklist[0]:
+        if buffered or self.socket() in socklist[0]:
             rc = self.loop_read(max_packets)
             if rc or (self._ssl is None and self._sock is None):
                 return rc
@@ -1061,21 +1136,41 @@ class Client(object):
         Use socket() to obtain the client socket to call select() or equivalent
         on.
 
+        max_packets: The maximum number of incoming packets to handle, or 0 to
+          handle as many as are readable. At least as many packets as there
+          are messages part way through their network flow are handled.
+          Handling also stops once the time set with read_budget_set() has
+          been spent, so that keepalive and outgoing traffic are not held up
+          by a flood of incoming messages. Packets not yet handled are kept
+          buffered for the next call.
+
         Do not use if you are using the threaded interface loop_start()."""
         if self._sock is None and self._ssl is None:
             return MQTT_ERR_NO_CONN
 
-        max_packets = len(self._out_messages) + len(self._in_messages)
-        if max_packets < 1:
-            max_packets = 1
+        if max_packets > 0:
+            max_packets = max(max_packets, len(self._out_messages) + len(self._in_messages))
+        deadline = None
+        if self._read_budget is not None:
+            deadline = time.time() + self._read_budget
 
-        for i in range(0, max_packets):
+        handled = 0
+        while True:
+            rc, count = self._packet_read_buffer(max_packets - handled if max_packets > 0 else 0, deadline)
+            handled += count
+            if rc > 0:
+                return self._loop_rc_handle(rc)
+            if max_packets > 0 and handled >= max_packets:
+                return MQTT_ERR_SUCCESS
+            # Always handle at least one packet, so that a small budget
+            # can't keep buffered packets from ever being handled.
+            if deadline is not None and handled > 0 and time.time() >= deadline:
+                return MQTT_ERR_SUCCESS
             rc = self._packet_read()
             if rc > 0:
                 return self._loop_rc_handle(rc)
             elif rc == MQTT_ERR_AGAIN:
                 return MQTT_ERR_SUCCESS
-        return MQTT_ERR_SUCCESS
 
     def loop_write(self, max_packets=1):
         """Process read network events. Use in place of calling loop() if you
@@ -1150,6 +1245,12 @@ class Client(object):
 
         return MQTT_ERR_SUCCESS
 
+    def log_levels_set(self, levels):
+        """Set the log levels passed to on_log as a bitmask of MQTT_LOG_*
+        values, e.g. MQTT_LOG_ERR | MQTT_LOG_WARNING. Messages of other levels
+        are not formatted at all. Defaults to MQTT_LOG_ALL."""
+        self._log_levels = levels & MQTT_LOG_ALL
+
     def max_inflight_messages_set(self, inflight):
         """Set the maximum number of messages with QoS>0 that can be part way
         through their network flow at once. Defaults to 20."""
@@ -1165,6 +1266,30 @@ class Client(object):
 
         self._message_retry = retry
 
+    def message_reuse_set(self, reuse):
+        """Set whether to reuse the MQTTMessage instance passed to on_message
+        for messages with QoS 0 or 1, avoiding an allocation per message.
+        Only enable if callbacks don't keep references to messages after
+        returning. Defaults to False."""
+        self._message_reuse = bool(reuse)
+
+    def payload_view_set(self, value):
+        """Set whether payloads of messages with QoS 0 or 1 are given as a
+        memoryview into the read buffer instead of bytes, avoiding a copy of
+        each payload. The view is released once callbacks return, so only
+        enable if callbacks don't keep payloads and accept any bytes-like
+        object, e.g. for re or json.loads(bytes(payload)). Defaults to False."""
+        self._payload_view = bool(value)
+
+    def read_budget_set(self, budget):
+        """Set the maximum time in seconds to spend handling incoming packets
+        in one call of loop_read(), or None for no limit. 0.1 seconds by
+        default."""
+        if budget is not None and budget < 0:
+            raise ValueError('Invalid budget.')
+
+        self._read_budget = budget
+
     def user_data_set(self, userdata):
         """Set the user data variable passed to callbacks. May be any data type."""
         self._userdata = userdata
@@ -1235,7 +1360,8 @@ class Client(object):
 
         timeout: The time in seconds to wait for incoming/outgoing network
           traffic before timing out and returning.
-        max_packets: Not currently used.
+        max_packets: The maximum number of incoming packets to handle per
+          network event, or 0 to handle as many as are readable. See loop_read().
         retry_first_connection: Should the first connection attempt be retried on failure.
 
         Raises socket.error on first connection failures unless retry_first_connection=True
@@ -1293,14 +1419,18 @@ class Client(object):
 
         return rc
 
-    def loop_start(self):
+    def loop_start(self, max_packets=1):
         """This is part of the threaded client interface. Call this once to
         start a new thread to process network traffic. This provides an
         alternative to repeatedly calling loop() yourself.
+
+        max_packets: The maximum number of incoming packets to handle per
+          network event, or 0 to handle as many as are readable. See loop_read().
         """
         if self._thread is not None:
             return MQTT_ERR_INVAL
 
+        self._thread_max_packets = max_packets
         self._thread_terminate = False
         self._thread = threading.Thread(target=self._thread_main)
         self._thread.daemon = True
@@ -1336,13 +1466,14 @@ class Client(object):
 
         self._callback_mutex.acquire()
 
-        for i in range(0, len(self.on_message_filtered)):
-            if self.on_message_filtered[i][0] == sub:
-                self.on_message_filtered[i] = (sub, callback)
-                self._callback_mutex.release()
-                return
-
-        self.on_message_filtered.append((sub, callback))
+        # Callbacks are called in the order they were first added,
+        # replacing a callback keeps the position of the original.
+        try:
+            order = self._on_message_filtered[sub][0]
+        except KeyError:
+            order = self._on_message_filtered_count
+            self._on_message_filtered_count += 1
+        self._on_message_filtered[sub] = (order, callback)
         self._callback_mutex.release()
 
     def message_callback_remove(self, sub):
@@ -1352,13 +1483,29 @@ class Client(object):
             raise ValueError("sub must defined.")
 
         self._callback_mutex.acquire()
-        for i in range(0, len(self.on_message_filtered)):
-            if self.on_message_filtered[i][0] == sub:
-                self.on_message_filtered.pop(i)
-                self._callback_mutex.release()
-                return
+        try:
+            del self._on_message_filtered[sub]
+        except KeyError:
+            pass
         self._callback_mutex.release()
 
+    @property
+    def on_message_filtered(self):
+        """A list of (sub, callback) tuples of callbacks registered with
+        message_callback_add(), in the order they were added. Modify with
+        message_callback_add() and message_callback_remove()."""
+        # Don't take _callback_mutex, which is held during callbacks that
+        # might read this. Callbacks removed meanwhile are just left out.
+        callbacks = []
+        for sub in self._on_message_filtered:
+            try:
+                order, callback = self._on_message_filtered[sub]
+            except KeyError:
+                continue
+            callbacks.append((order, sub, callback))
+        callbacks.sort(key=lambda t: t[0])
+        return [(sub, callback) for order, sub, callback in callbacks]
+
     # ============================================================
     # Private functions
     # ============================================================
@@ -1385,110 +1532,119 @@ class Client(object):
             self._callback_mutex.release()
         return rc
 
+    def _packet_buffered(self):
+        # Return True if there is a complete packet in the read buffer.
+        header = _decode_remaining_length(self._in_buffer, 1)
+        if header is None:
+            return False
+        remaining_length, start = header
+        return remaining_length < 0 or start + remaining_length <= len(self._in_buffer)
+
     def _packet_read(self):
         # This gets called if pselect() indicates that there is network data
-        # available - ie. at least one byte.  What we do depends on what data we
-        # already have.
-        # If we've not got a command, attempt to read one and save it. This should
-        # always work because it's only a single byte.
-        # Then try to read the remaining length. This may fail because it is may
-        # be more than one byte - will need to save data pending next read if it
-        # does fail.
-        # Then try to read the remaining payload, where 'payload' here means the
-        # combined variable header and actual payload. This is the most likely to
-        # fail due to longer length, so save current data and current position.
-        # After all data is read, send to _mqtt_handle_packet() to deal with.
-        # Finally, free the memory and reset everything to starting conditions.
-        if self._in_packet['command'] == 0:
-            try:
-                if self._ssl:
-                    command = self._ssl.read(1)
-                else:
-                    command = self._sock.recv(1)
-            except socket.error as err:
-                if self._ssl and (err.errno == ssl.SSL_ERROR_WANT_READ or err.errno == ssl.SSL_ERROR_WANT_WRITE):
-                    return MQTT_ERR_AGAIN
-                if err.errno == EAGAIN:
-                    return MQTT_ERR_AGAIN
-                print(err)
-                return 1
+        # available - ie. at least one byte.  Read as much data as is available
+        # in one go, up to _READ_CHUNK_SIZE, into a buffer that is kept across
+        # calls, from which _packet_read_buffer() handles complete packets.
+        # Whatever remains is the start of a packet, which will be completed
+        # by later reads. This takes one system call per read instead of
+        # several per packet, and avoids copying packet data except once
+        # to pass it on to handlers.
+        try:
+            if self._ssl:
+                data = self._ssl.read(_READ_CHUNK_SIZE)
+                # Decrypted data held by the SSL object doesn't make the
+                # socket readable, so it needs to be read out right away.
+                while self._ssl.pending():
+                    data += self._ssl.read(self._ssl.pending())
             else:
-                if len(command) == 0:
-                    return 1
-                command = struct.unpack("!B", command)
-                self._in_packet['command'] = command[0]
-
-        if self._in_packet['have_remaining'] == 0:
-            # Read remaining
-            # Algorithm for decoding taken from pseudo code at
-            # http://publib.boulder.ibm.com/infocenter/wmbhelp/v6r0m0/topic/com.ibm.etools.mft.doc/ac10870_.htm
-            while True:
-                try:
-                    if self._ssl:
-                        byte = self._ssl.read(1)
-                    else:
-                        byte = self._sock.recv(1)
-                except socket.error as err:
-                    if self._ssl and (err.errno == ssl.SSL_ERROR_WANT_READ or err.errno == ssl.SSL_ERROR_WANT_WRITE):
-                        return MQTT_ERR_AGAIN
-                    if err.errno == EAGAIN:
-                        return MQTT_ERR_AGAIN
-                    print(err)
-                    return 1
-                else:
-                    byte = struct.unpack("!B", byte)
-                    byte = byte[0]
-                    self._in_packet['remaining_count'].append(byte)
-                    # Max 4 bytes length for remaining length as defined by protocol.
-                     # Anything more likely means a broken/malicious client.
-                    if len(self._in_packet['remaining_count']) > 4:
-                        return MQTT_ERR_PROTOCOL
-
-                    self._in_packet['remaining_length'] = self._in_packet['remaining_length'] + (byte & 127)*self._in_packet['remaining_mult']
-                    self._in_packet['remaining_mult'] = self._in_packet['remaining_mult'] * 128
+                data = self._sock.recv(_READ_CHUNK_SIZE)
+        except socket.error as err:
+            if self._ssl and (err.errno == ssl.SSL_ERROR_WANT_READ or err.errno == ssl.SSL_ERROR_WANT_WRITE):
+                return MQTT_ERR_AGAIN
+            if err.errno == EAGAIN:
+                return MQTT_ERR_AGAIN
+            self._easy_log(MQTT_LOG_ERR, "Failed to read from socket: %s", err)
+            return 1
+        if len(data) == 0:
+            return 1
+        self._in_buffer += data
+        return MQTT_ERR_SUCCESS
 
-                if (byte & 128) == 0:
+    def _packet_read_buffer(self, max_packets=0, deadline=None):
+        # Handle complete packets in the read buffer, up to max_packets if
+        # given and until deadline if given, leaving the rest in the buffer.
+        # Returns a tuple of the result and the number of packets handled.
+        # The buffer is only compacted once at the end, with packets passed
+        # to handlers as views into the buffer in between. Handlers must copy
+        # what they keep, since the buffer can't be compacted while there are
+        # views into it and data in it is overwritten by later reads.
+        buf = self._in_buffer
+        view = memoryview(buf)
+        pos = 0
+        count = 0
+        rc = MQTT_ERR_SUCCESS
+        trace = self.on_trace is not None
+        try:
+            while pos < len(buf):
+                if max_packets > 0 and count >= max_packets:
                     break
-
-            self._in_packet['have_remaining'] = 1
-            self._in_packet['to_process'] = self._in_packet['remaining_length']
-
-        while self._in_packet['to_process'] > 0:
+                if deadline is not None and count > 0 and time.time() >= deadline:
+                    break
+                header = _decode_remaining_length(buf, pos + 1)
+                if header is None:
+                    break
+                remaining_length, start = header
+                if remaining_length < 0:
+                    # Max 4 bytes length for remaining length as defined by protocol.
+                    # Anything more likely means a broken/malicious client.
+                    rc = MQTT_ERR_PROTOCOL
+                    break
+                end = start + remaining_length
+                if end > len(buf):
+                    break
+                self._in_packet = dict(
+                    command=buf[pos],
+                    have_remaining=1,
+                    remaining_count=[],
+                    remaining_mult=1,
+                    remaining_length=remaining_length,
+                    packet=view[start:end],
+                    to_process=0,
+                    pos=0)
+                size = end - pos
+                pos = end
+                count += 1
+                if trace:
+                    started = time.time()
+                rc = self._packet_handle()
+                if trace:
+                    self._trace("in", buf[pos - size], size, started)
+                if rc != MQTT_ERR_SUCCESS:
+                    break
+        finally:
+            if count > 0:
+                # Free data and reset values
+                self._in_packet = dict(
+                    command=0,
+                    have_remaining=0,
+                    remaining_count=[],
+                    remaining_mult=1,
+                    remaining_length=0,
+                    packet=b"",
+                    to_process=0,
+                    pos=0)
             try:
-                if self._ssl:
-                    data = self._ssl.read(self._in_packet['to_process'])
-                else:
-                    data = self._sock.recv(self._in_packet['to_process'])
-            except socket.error as err:
-                if self._ssl and (err.errno == ssl.SSL_ERROR_WANT_READ or err.errno == ssl.SSL_ERROR_WANT_WRITE):
-                    return MQTT_ERR_AGAIN
-                if err.errno == EAGAIN:
-                    return MQTT_ERR_AGAIN
-                print(err)
-                return 1
-            else:
-                self._in_packet['to_process'] = self._in_packet['to_process'] - len(data)
-                self._in_packet['packet'] = self._in_packet['packet'] + data
-
-        # All data for this packet is read.
-        self._in_packet['pos'] = 0
-        rc = self._packet_handle()
-
-        # Free data and reset values
-        self._in_packet = dict(
-            command=0,
-            have_remaining=0,
-            remaining_count=[],
-            remaining_mult=1,
-            remaining_length=0,
-            packet=b"",
-            to_process=0,
-            pos=0)
-
-        self._msgtime_mutex.acquire()
-        self._last_msg_in = time.time()
-        self._msgtime_mutex.release()
-        return rc
+                view.release()
+                del buf[:pos]
+            except BufferError:
+                # A view into the buffer is still referenced, e.g. from
+                # a traceback, so continue with a copy of the rest.
+                self._in_buffer = buf[pos:]
+        if count > 0:
+            self._msgtime_mutex.acquire()
+            self._last_msg_in = time.time()
+            self._msgtime_mutex.release()
+        return rc, count
 
     def _packet_write(self):
         self._current_out_packet_mutex.acquire()
@@ -1510,7 +1666,7 @@ class Client(object):
                     return MQTT_ERR_AGAIN
                 if err.errno == EAGAIN:
                     return MQTT_ERR_AGAIN
-                print(err)
+                self._easy_log(MQTT_LOG_ERR, "Failed to write to socket: %s", err)
                 return 1
 
             if write_length > 0:
@@ -1518,6 +1674,9 @@ class Client(object):
                 packet['pos'] = packet['pos'] + write_length
 
                 if packet['to_process'] == 0:
+                    if self.on_trace is not None:
+                        self._trace("out", packet['command'], len(packet['packet']), packet['queued'])
+
                     if (packet['command'] & 0xF0) == PUBLISH and packet['qos'] == 0:
                         self._callback_mutex.acquire()
                         if self.on_publish:
@@ -1566,9 +1725,26 @@ class Client(object):
 
         return MQTT_ERR_SUCCESS
 
-    def _easy_log(self, level, buf):
-        if self.on_log:
-            self.on_log(self, self._userdata, level, buf)
+    def _easy_log(self, level, fmt, *args):
+        # Formatting is deferred until we know the message is wanted,
+        # so that disabled logging costs no string building.
+        on_log = self.on_log
+        if on_log is None or not level & self._log_levels:
+            return
+        buf = fmt % args if args else fmt
+        on_log(self, self._userdata, level, buf)
+
+    def _trace(self, direction, command, size, start):
+        on_trace = self.on_trace
+        if on_trace is None:
+            return
+        event = dict(
+            direction=direction,
+            type=_PACKET_NAMES.get(command & 0xF0, "UNKNOWN"),
+            size=size,
+            time=start,
+            duration=time.time() - start)
+        on_trace(self, self._userdata, event)
 
     def _check_keepalive(self):
         now = time.time()
@@ -1629,11 +1805,11 @@ class Client(object):
         return self._send_simple_command(PINGRESP)
 
     def _send_puback(self, mid):
-        self._easy_log(MQTT_LOG_DEBUG, "Sending PUBACK (Mid: "+str(mid)+")")
+        self._easy_log(MQTT_LOG_DEBUG, "Sending PUBACK (Mid: %d)", mid)
         return self._send_command_with_mid(PUBACK, mid, False)
 
     def _send_pubcomp(self, mid):
-        self._easy_log(MQTT_LOG_DEBUG, "Sending PUBCOMP (Mid: "+str(mid)+")")
+        self._easy_log(MQTT_LOG_DEBUG, "Sending PUBCOMP (Mid: %d)", mid)
         return self._send_command_with_mid(PUBCOMP, mid, False)
 
     def _pack_remaining_length(self, packet, remaining_length):
@@ -1687,7 +1863,7 @@ class Client(object):
         packet.extend(struct.pack("!B", command))
         if payload is None:
             remaining_length = 2+len(utopic)
-            self._easy_log(MQTT_LOG_DEBUG, "Sending PUBLISH (d"+str(dup)+", q"+str(qos)+", r"+str(int(retain))+", m"+str(mid)+", '"+topic+"' (NULL payload)")
+            self._easy_log(MQTT_LOG_DEBUG, "Sending PUBLISH (d%s, q%d, r%d, m%d, '%s' (NULL payload)", dup, qos, retain, mid, topic)
         else:
             if isinstance(payload, str):
                 upayload = payload.encode('utf-8')
@@ -1699,7 +1875,7 @@ class Client(object):
                 payloadlen = len(upayload)
 
             remaining_length = 2+len(utopic) + payloadlen
-            self._easy_log(MQTT_LOG_DEBUG, "Sending PUBLISH (d"+str(dup)+", q"+str(qos)+", r"+str(int(retain))+", m"+str(mid)+", '"+topic+"', ... ("+str(payloadlen)+" bytes)")
+            self._easy_log(MQTT_LOG_DEBUG, "Sending PUBLISH (d%s, q%d, r%d, m%d, '%s', ... (%d bytes)", dup, qos, retain, mid, topic, payloadlen)
 
         if qos > 0:
             # For message id
@@ -1727,11 +1903,11 @@ class Client(object):
         return self._packet_queue(PUBLISH, packet, mid, qos)
 
     def _send_pubrec(self, mid):
-        self._easy_log(MQTT_LOG_DEBUG, "Sending PUBREC (Mid: "+str(mid)+")")
+        self._easy_log(MQTT_LOG_DEBUG, "Sending PUBREC (Mid: %d)", mid)
         return self._send_command_with_mid(PUBREC, mid, False)
 
     def _send_pubrel(self, mid, dup=False):
-        self._easy_log(MQTT_LOG_DEBUG, "Sending PUBREL (Mid: "+str(mid)+")")
+        self._easy_log(MQTT_LOG_DEBUG, "Sending PUBREL (Mid: %d)", mid)
         return self._send_command_with_mid(PUBREL|2, mid, dup)
 
     def _send_command_with_mid(self, command, mid, dup):
@@ -1906,7 +2082,8 @@ class Client(object):
             qos = qos,
             pos = 0,
             to_process = len(packet),
-            packet = packet)
+            packet = packet,
+            queued = time.time())
 
         self._out_packet_mutex.acquire()
         self._out_packet.append(mpkt)
@@ -1953,7 +2130,7 @@ class Client(object):
             return self._handle_unsuback()
         else:
             # If we don't recognise the command, return an error straight away.
-            self._easy_log(MQTT_LOG_ERR, "Error: Unrecognised command "+str(cmd))
+            self._easy_log(MQTT_LOG_ERR, "Error: Unrecognised command %s", cmd)
             return MQTT_ERR_PROTOCOL
 
     def _handle_pingreq(self):
@@ -1984,7 +2161,7 @@ class Client(object):
 
         (flags, result) = struct.unpack("!BB", self._in_packet['packet'])
         if result == CONNACK_REFUSED_PROTOCOL_VERSION and self._protocol == MQTTv311:
-            self._easy_log(MQTT_LOG_DEBUG, "Received CONNACK ("+str(flags)+", "+str(result)+"), attempting downgrade to MQTT v3.1.")
+            self._easy_log(MQTT_LOG_DEBUG, "Received CONNACK (%s, %s), attempting downgrade to MQTT v3.1.", flags, result)
             # Downgrade to MQTT v3.1
             self._protocol = MQTTv31
             return self.reconnect()
@@ -1992,7 +2169,7 @@ class Client(object):
         if result == 0:
             self._state = mqtt_cs_connected
 
-        self._easy_log(MQTT_LOG_DEBUG, "Received CONNACK ("+str(flags)+", "+str(result)+")")
+        self._easy_log(MQTT_LOG_DEBUG, "Received CONNACK (%s, %s)", flags, result)
         self._callback_mutex.acquire()
         if self.on_connect:
             self._in_callback = True
@@ -2083,43 +2260,71 @@ class Client(object):
     def _handle_publish(self):
         rc = 0
 
+        # Decode fields at their offsets in the packet, which is usually a view
+        # into the read buffer, so that the only copies made are the topic
+        # string and the payload, unless the payload is given as a view too.
         header = self._in_packet['command']
-        message = MQTTMessage()
+        packet = self._in_packet['packet']
+        if not isinstance(packet, memoryview):
+            packet = memoryview(packet)
+        if len(packet) < 2:
+            return MQTT_ERR_PROTOCOL
+        (slen,) = struct.unpack_from("!H", packet, 0)
+        pos = 2 + slen
+        if slen == 0 or pos > len(packet):
+            return MQTT_ERR_PROTOCOL
+
+        qos = (header & 0x06)>>1
+        if self._message_reuse and qos < 2:
+            # Messages with QoS 2 are held until PUBREL, others are done
+            # with once callbacks return, allowing reuse if callbacks
+            # don't hold on to them either.
+            message = self._in_message_reused
+            message.state = mqtt_ms_invalid
+            message.mid = 0
+        else:
+            message = MQTTMessage()
         message.dup = (header & 0x08)>>3
-        message.qos = (header & 0x06)>>1
+        message.qos = qos
         message.retain = (header & 0x01)
 
-        pack_format = "!H" + str(len(self._in_packet['packet'])-2) + 's'
-        (slen, packet) = struct.unpack(pack_format, self._in_packet['packet'])
-        pack_format = '!' + str(slen) + 's' + str(len(packet)-slen) + 's'
-        (message.topic, packet) = struct.unpack(pack_format, packet)
-
-        if len(message.topic) == 0:
-            return MQTT_ERR_PROTOCOL
-
         if sys.version_info[0] >= 3:
-            message.topic = message.topic.decode('utf-8')
+            message.topic = str(packet[2:pos], 'utf-8')
+        else:
+            message.topic = packet[2:pos].tobytes()
 
         if message.qos > 0:
-            pack_format = "!H" + str(len(packet)-2) + 's'
-            (message.mid, packet) = struct.unpack(pack_format, packet)
-
-        message.payload = packet
+            if pos + 2 > len(packet):
+                return MQTT_ERR_PROTOCOL
+            (message.mid,) = struct.unpack_from("!H", packet, pos)
+            pos += 2
+
+        # Data in the read buffer is overwritten by later reads, a view into
+        # it can only be given if the message is done with once callbacks
+        # return, i.e. not for QoS 2 messages, which are held until PUBREL.
+        view = self._payload_view and message.qos < 2 and sys.version_info[0] >= 3
+        if view:
+            message.payload = packet[pos:]
+        else:
+            message.payload = packet[pos:].tobytes()
 
         self._easy_log(
             MQTT_LOG_DEBUG,
-            "Received PUBLISH (d"+str(message.dup)+
-            ", q"+str(message.qos)+", r"+str(message.retain)+
-            ", m"+str(message.mid)+", '"+message.topic+
-            "', ...  ("+str(len(message.payload))+" bytes)")
+            "Received PUBLISH (d%s, q%s, r%s, m%s, '%s', ...  (%d bytes)",
+            message.dup, message.qos, message.retain, message.mid,
+            message.topic, len(message.payload))
 
         message.timestamp = time.time()
         if message.qos == 0:
             self._handle_on_message(message)
+            if view:
+                message.payload.release()
             return MQTT_ERR_SUCCESS
         elif message.qos == 1:
             rc = self._send_puback(message.mid)
             self._handle_on_message(message)
+            if view:
+                message.payload.release()
             return rc
         elif message.qos == 2:
             rc = self._send_pubrec(message.mid)
@@ -2141,7 +2346,7 @@ class Client(object):
 
         mid = struct.unpack("!H", self._in_packet['packet'])
         mid = mid[0]
-        self._easy_log(MQTT_LOG_DEBUG, "Received PUBREL (Mid: "+str(mid)+")")
+        self._easy_log(MQTT_LOG_DEBUG, "Received PUBREL (Mid: %d)", mid)
 
         self._in_message_mutex.acquire()
         for i in range(len(self._in_messages)):
@@ -2190,7 +2395,7 @@ class Client(object):
 
         mid = struct.unpack("!H", self._in_packet['packet'])
         mid = mid[0]
-        self._easy_log(MQTT_LOG_DEBUG, "Received PUBREC (Mid: "+str(mid)+")")
+        self._easy_log(MQTT_LOG_DEBUG, "Received PUBREC (Mid: %d)", mid)
 
         self._out_message_mutex.acquire()
         for m in self._out_messages:
@@ -2210,7 +2415,7 @@ class Client(object):
 
         mid = struct.unpack("!H", self._in_packet['packet'])
         mid = mid[0]
-        self._easy_log(MQTT_LOG_DEBUG, "Received UNSUBACK (Mid: "+str(mid)+")")
+        self._easy_log(MQTT_LOG_DEBUG, "Received UNSUBACK (Mid: %d)", mid)
         self._callback_mutex.acquire()
         if self.on_unsubscribe:
             self._in_callback = True
@@ -2226,7 +2431,7 @@ class Client(object):
 
         mid = struct.unpack("!H", self._in_packet['packet'])
         mid = mid[0]
-        self._easy_log(MQTT_LOG_DEBUG, "Received "+cmd+" (Mid: "+str(mid)+")")
+        self._easy_log(MQTT_LOG_DEBUG, "Received %s (Mid: %d)", cmd, mid)
 
         self._out_message_mutex.acquire()
         for i in range(len(self._out_messages)):
@@ -2261,15 +2466,15 @@ class Client(object):
 
     def _handle_on_message(self, message):
         self._callback_mutex.acquire()
-        matched = False
-        for t in self.on_message_filtered:
-            if topic_matches_sub(t[0], message.topic):
-                self._in_callback = True
-                t[1](self, self._userdata, message)
-                self._in_callback = False
-                matched = True
+        matched = list(self._on_message_filtered.iter_match(message.topic))
+        if len(matched) > 1:
+            matched.sort(key=lambda t: t[0])
+        for t in matched:
+            self._in_callback = True
+            t[1](self, self._userdata, message)
+            self._in_callback = False
 
-        if matched == False and self.on_message:
+        if not matched and self.on_message:
             self._in_callback = True
             self.on_message(self, self._userdata, message)
             self._in_callback = False
@@ -2284,7 +2489,7 @@ class Client(object):
         else:
             self._state_mutex.release()
 
-        self.loop_forever()
+        self.loop_forever(max_packets=self._thread_max_packets)
 
     def _host_matches_cert(self, host, cert_host):
         if cert_host[0:2] == "*.":
@@ -0,0 +1,132 @@
+# Copyright (c) 2016 Osmo Salomaa <otsaloma@iki.fi>
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Eclipse Public License v1.0
+# and Eclipse Distribution License v1.0 which accompany this distribution.
+#
+# The Eclipse Public License is available at
+#    http://www.eclipse.org/legal/epl-v10.html
+# and the Eclipse Distribution License is available at
+#   http://www.eclipse.org/org/documents/edl-v10.php.
+#
+# Contributors:
+#    Osmo Salomaa - topic trie for filtered message callbacks, written for
+#                   helsinki-transit-live as an addition to the bundled client
+
+"""
+Matching of topic names against topic filters with wildcards.
+"""
+
+
+class MQTTMatcher(object):
+    """Store values by topic filter and find the values of all filters that
+    match a topic name.
+
+    Filters are stored in a tree with one level per topic level, branching
+    on literal levels and the '+' and '#' wildcards, so that finding matches
+    for a topic takes time proportional to the number of topic levels rather
+    than to the number of filters stored.
+
+    Use like a dictionary keyed by filter, with iter_match() to find values
+    of filters matching a topic."""
+
+    class Node(object):
+        __slots__ = ('children', 'content')
+
+        def __init__(self):
+            self.children = {}
+            self.content = None
+
+    _empty = object()
+
+    def __init__(self):
+        self._root = self.Node()
+        self._root.content = self._empty
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __delitem__(self, key):
+        path = []
+        node = self._root
+        for level in key.split('/'):
+            if level not in node.children:
+                raise KeyError(key)
+            path.append((node, level))
+            node = node.children[level]
+        if node.content is self._empty:
+            raise KeyError(key)
+        node.content = self._empty
+        # Prune branches that no longer lead to any values.
+        for parent, level in reversed(path):
+            child = parent.children[level]
+            if child.children or child.content is not self._empty:
+                break
+            del parent.children[level]
+
+    def __getitem__(self, key):
+        node = self._root
+        for level in key.split('/'):
+            if level not in node.children:
+                raise KeyError(key)
+            node = node.children[level]
+        if node.content is self._empty:
+            raise KeyError(key)
+        return node.content
+
+    def __iter__(self):
+        # Yield filters stored, rebuilding them from the path to each node.
+        stack = [(self._root, [])]
+        while stack:
+            node, path = stack.pop()
+            if path and node.content is not self._empty:
+                yield '/'.join(path)
+            for level, child in list(node.children.items()):
+                stack.append((child, path + [level]))
+
+    def __setitem__(self, key, value):
+        node = self._root
+        for level in key.split('/'):
+            child = node.children.get(level)
+            if child is None:
+                child = node.children[level] = self.Node()
+                child.content = self._empty
+            node = child
+        node.content = value
+
+    def iter_match(self, topic):
+        """Return an iterator over values of filters matching topic."""
+        levels = topic.split('/')
+        depth = len(levels)
+        # Wildcards at the first level don't match topics starting
+        # with '$', which are reserved for broker internal use.
+        system = topic.startswith('$')
+        empty = self._empty
+        stack = [(self._root, 0)]
+        while stack:
+            node, i = stack.pop()
+            children = node.children
+            if not children:
+                if i == depth and node.content is not empty:
+                    yield node.content
+                continue
+            wild = not (system and i == 0)
+            if wild and '#' in children:
+                # Matches this level and all below, including the parent
+                # level, e.g. "a/#" matches "a" as well as "a/b/c".
+                content = children['#'].content
+                if content is not empty:
+                    yield content
+            if i == depth:
+                if node.content is not empty:
+                    yield node.content
+                continue
+            child = children.get(levels[i])
+            if child is not None:
+                stack.append((child, i + 1))
+            if wild and '+' in children:
+                stack.append((children['+'], i + 1))
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 Osmo Salomaa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import htl.test
+import paho.mqtt.client as mqtt
+import socket
+import struct
+import time
+
+
+def encode(topic, payload, qos=0, mid=1):
+    """Return a PUBLISH packet of `topic` and `payload`."""
+    topic = topic.encode("utf_8")
+    body = struct.pack("!H", len(topic)) + topic
+    if qos > 0:
+        body += struct.pack("!H", mid)
+    body += payload
+    length, remaining = bytearray(), len(body)
+    while True:
+        byte, remaining = remaining % 128, remaining // 128
+        length.append(byte | (128 if remaining else 0))
+        if not remaining: break
+    return bytes([mqtt.PUBLISH | (qos << 1)]) + bytes(length) + body
+
+
+class TestClient(htl.test.TestCase):
+
+    def setup_method(self, method):
+        self.client = mqtt.Client()
+        self.client.on_message = self.on_message
+        self.client._sock, self.peer = socket.socketpair()
+        self.client._sock.setblocking(False)
+        self.received = []
+
+    def teardown_method(self, method):
+        self.client._sock.close()
+        self.peer.close()
+
+    def on_message(self, client, userdata, message):
+        self.received.append((message.topic, bytes(message.payload)))
+
+    def test_log_levels_set(self):
+        formatted = []
+        class Argument:
+            def __str__(self):
+                formatted.append(1)
+                return "x"
+        logged = []
+        self.client.on_log = lambda client, userdata, level, buf: (
+            logged.append((level, buf)))
+        self.client.log_levels_set(mqtt.MQTT_LOG_ERR | mqtt.MQTT_LOG_WARNING)
+        self.client._easy_log(mqtt.MQTT_LOG_DEBUG, "%s", Argument())
+        self.peer.sendall(encode("a/b", b"hello"))
+        assert self.client.loop_read(0) == mqtt.MQTT_ERR_SUCCESS
+        assert formatted == []
+        assert logged == []
+        self.client._easy_log(mqtt.MQTT_LOG_ERR, "%s", Argument())
+        assert formatted == [1]
+        assert logged == [(mqtt.MQTT_LOG_ERR, "x")]
+
+    def test_log_levels_set__all(self):
+        logged = []
+        self.client.on_log = lambda client, userdata, level, buf: (
+            logged.append((level, buf)))
+        self.peer.sendall(encode("a/b", b"hello"))
+        assert self.client.loop_read(0) == mqtt.MQTT_ERR_SUCCESS
+        assert logged == [(mqtt.MQTT_LOG_DEBUG,
+                           "Received PUBLISH (d0, q0, r0, m0, 'a/b', ...  (5 bytes)")]
+
+    def test_log_levels_set__no_on_log(self):
+        formatted = []
+        class Argument:
+            def __str__(self):
+                formatted.append(1)
+                return "x"
+        self.client._easy_log(mqtt.MQTT_LOG_ERR, "%s", Argument())
+        assert formatted == []
+
+    def test_loop__buffered(self):
+        messages = [("a/{:d}".format(i), b"x") for i in range(3)]
+        self.peer.sendall(b"".join(encode(*x) for x in messages))
+        assert self.client.loop(timeout=1.0, max_packets=1) == mqtt.MQTT_ERR_SUCCESS
+        assert self.received == messages[:1]
+        # Packets left in the buffer don't make the socket readable,
+        # they should be handled right away without waiting for timeout.
+        start = time.time()
+        assert self.client.loop(timeout=1.0, max_packets=1) == mqtt.MQTT_ERR_SUCCESS
+        assert self.client.loop(timeout=1.0, max_packets=1) == mqtt.MQTT_ERR_SUCCESS
+        assert time.time() - start < 0.5
+        assert self.received == messages
+
+    def test_loop_read__budget(self):
+        messages = [("a/{:d}".format(i), b"x") for i in range(3)]
+        self.peer.sendall(b"".join(encode(*x) for x in messages))
+        # With no time to spend, one packet should be handled per call.
+        self.client.read_budget_set(0)
+        for i in range(len(messages)):
+            assert self.client.loop_read(0) == mqtt.MQTT_ERR_SUCCESS
+            assert self.received == messages[:i+1]
+
+    def test_loop_read__budget_slow(self):
+        def on_message(client, userdata, message):
+            self.on_message(client, userdata, message)
+            time.sleep(0.05)
+        self.client.on_message = on_message
+        messages = [("a/{:d}".format(i), b"x") for i in range(10)]
+        self.peer.sendall(b"".join(encode(*x) for x in messages))
+        self.client.read_budget_set(0.1)
+        assert self.client.loop_read(0) == mqtt.MQTT_ERR_SUCCESS
+        assert 1 <= len(self.received) < len(messages)
+        assert self.client._packet_buffered()
+        while len(self.received) < len(messages):
+            assert self.client.loop_read(0) == mqtt.MQTT_ERR_SUCCESS
+        assert self.received == messages
+
+    def test_loop_read__drip(self):
+        packet = encode("a/b", b"hello")
+        for i in range(len(packet)):
+            assert self.received == []
+            self.peer.sendall(packet[i:i+1])
+            assert self.client.loop_read(0) == mqtt.MQTT_ERR_SUCCESS
+        assert self.received == [("a/b", b"hello")]
+        assert len(self.client._in_buffer) == 0
+
+    def test_loop_read__eagain(self):
+        packet = encode("a/b", b"hello")
+        self.peer.sendall(packet[:6])
+        # Nothing more to read raises EAGAIN mid-packet,
+        # which should leave the partial packet buffered.
+        assert self.client.loop_read(0) == mqtt.MQTT_ERR_SUCCESS
+        assert self.received == []
+        assert bytes(self.client._in_buffer) == packet[:6]
+        self.peer.sendall(packet[6:])
+        assert self.client.loop_read(0) == mqtt.MQTT_ERR_SUCCESS
+        assert self.received == [("a/b", b"hello")]
+
+    def test_loop_read__max_packets(self):
+        messages = [("a/{:d}".format(i), b"x") for i in range(5)]
+        self.peer.sendall(b"".join(encode(*x) for x in messages))
+        assert self.client.loop_read(2) == mqtt.MQTT_ERR_SUCCESS
+        assert self.received == messages[:2]
+        assert self.client.loop_read(2) == mqtt.MQTT_ERR_SUCCESS
+        assert self.received == messages[:4]
+        assert self.client.loop_read(0) == mqtt.MQTT_ERR_SUCCESS
+        assert self.received == messages
+
+    def test_loop_read__several(self):
+        messages = [("a/{:d}".format(i), b"x" * i) for i in range(5)]
+        self.peer.sendall(b"".join(encode(*x) for x in messages))
+        assert self.client.loop_read(0) == mqtt.MQTT_ERR_SUCCESS
+        assert self.received == messages
+
+    def test_loop_read__payload(self):
+        payloads = []
+        self.client.on_message = lambda client, userdata, message: (
+            payloads.append(message.payload))
+        self.peer.sendall(encode("a/b", b"hello"))
+        assert self.client.loop_read(0) == mqtt.MQTT_ERR_SUCCESS
+        assert payloads == [b"hello"]
+        assert isinstance(payloads[0], bytes)
+
+    def test_loop_read__payload_view(self):
+        payloads = []
+        def on_message(client, userdata, message):
+            self.on_message(client, userdata, message)
+            payloads.append(message.payload)
+        self.client.on_message = on_message
+        self.client.payload_view_set(True)
+        self.peer.sendall(encode("a/b", b"hello") + encode("a/c", b"world"))
+        assert self.client.loop_read(0) == mqtt.MQTT_ERR_SUCCESS
+        assert self.received == [("a/b", b"hello"), ("a/c", b"world")]
+        # Views are into the read buffer and released once callbacks return.
+        assert isinstance(payloads[0], memoryview)
+        self.assert_raises(ValueError, bytes, payloads[0])
+        self.peer.sendall(encode("a/d", b"again"))
+        assert self.client.loop_read(0) == mqtt.MQTT_ERR_SUCCESS
+        assert self.received[-1] == ("a/d", b"again")
+
+    def test_loop_read__payload_view_qos2(self):
+        self.client.payload_view_set(True)
+        self.peer.sendall(encode("a/b", b"hello", qos=2))
+        assert self.client.loop_read(0) == mqtt.MQTT_ERR_SUCCESS
+        # Messages with QoS 2 are held until PUBREL, past the read buffer.
+        message = self.client._in_messages[0]
+        assert isinstance(message.payload, bytes)
+        assert message.payload == b"hello"
+
+    def test_loop_read__split_length(self):
+        packet = encode("a/b", b"x" * 200)
+        # Remaining length takes two bytes for 200 bytes of payload,
+        # split the read between those two bytes.
+        assert packet[1] & 128
+        self.peer.sendall(packet[:2])
+        assert self.client.loop_read(0) == mqtt.MQTT_ERR_SUCCESS
+        assert self.received == []
+        self.peer.sendall(packet[2:])
+        assert self.client.loop_read(0) == mqtt.MQTT_ERR_SUCCESS
+        assert self.received == [("a/b", b"x" * 200)]
+
+    def test_message_callback_add(self):
+        received = []
+        def callback(name):
+            return lambda client, userdata, message: received.append(name)
+        self.client.message_callback_add("a/+", callback("1"))
+        self.client.message_callback_add("a/#", callback("2"))
+        self.client.message_callback_add("b/+", callback("3"))
+        # Replacing keeps the position of the original.
+        self.client.message_callback_add("a/+", callback("4"))
+        self.client.message_callback_remove("b/+")
+        assert [x[0] for x in self.client.on_message_filtered] == ["a/+", "a/#"]
+        self.peer.sendall(encode("a/b", b"") + encode("c", b""))
+        assert self.client.loop_read(0) == mqtt.MQTT_ERR_SUCCESS
+        assert received == ["4", "2"]
+        assert self.received == [("c", b"")]
+
+    def test_on_trace(self):
+        events = []
+        self.client.on_trace = lambda client, userdata, event: events.append(event)
+        packet = encode("a/b", b"hello")
+        self.peer.sendall(packet)
+        assert self.client.loop_read(0) == mqtt.MQTT_ERR_SUCCESS
+        assert self.client._send_pingreq() == mqtt.MQTT_ERR_SUCCESS
+        assert self.peer.recv(2) == bytes([mqtt.PINGREQ, 0])
+        assert [(x["direction"], x["type"], x["size"]) for x in events] == [
+            ("in", "PUBLISH", len(packet)), ("out", "PINGREQ", 2)]
+        for event in events:
+            assert event["duration"] >= 0
+            assert event["time"] <= time.time()
+        # Tracing can be switched off at any time.
+        self.client.on_trace = None
+        self.peer.sendall(packet)
+        assert self.client.loop_read(0) == mqtt.MQTT_ERR_SUCCESS
+        assert len(events) == 2
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 Osmo Salomaa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import htl.test
+import itertools
+import paho.mqtt.client as mqtt
+
+from paho.mqtt.matcher import MQTTMatcher
+
+
+class TestMQTTMatcher(htl.test.TestCase):
+
+    def setup_method(self, method):
+        self.matcher = MQTTMatcher()
+
+    def match(self, sub, topic):
+        matcher = MQTTMatcher()
+        matcher[sub] = sub
+        return list(matcher.iter_match(topic)) == [sub]
+
+    def test___contains__(self):
+        self.matcher["a/+"] = 1
+        assert "a/+" in self.matcher
+        assert not "a" in self.matcher
+        assert not "a/b" in self.matcher
+
+    def test___delitem__(self):
+        self.matcher["a/b/c"] = 1
+        self.matcher["a/b"] = 2
+        del self.matcher["a/b/c"]
+        assert list(self.matcher.iter_match("a/b/c")) == []
+        assert list(self.matcher.iter_match("a/b")) == [2]
+        del self.matcher["a/b"]
+        # Branches left empty should be pruned.
+        assert self.matcher._root.children == {}
+        self.assert_raises(KeyError, self.matcher.__delitem__, "a/b")
+
+    def test___getitem__(self):
+        self.matcher["a/#"] = 1
+        assert self.matcher["a/#"] == 1
+        self.assert_raises(KeyError, self.matcher.__getitem__, "a")
+
+    def test___iter__(self):
+        for sub in ("a", "a/b", "+/#", "$SYS/#", ""):
+            self.matcher[sub] = 1
+        assert sorted(self.matcher) == sorted(["a", "a/b", "+/#", "$SYS/#", ""])
+
+    def test_iter_match__hash(self):
+        assert self.match("#", "a")
+        assert self.match("#", "a/b/c")
+        assert self.match("a/#", "a")
+        assert self.match("a/#", "a/b/c")
+        assert not self.match("a/#", "b/a")
+
+    def test_iter_match__plus(self):
+        assert self.match("+", "a")
+        assert self.match("a/+", "a/b")
+        assert self.match("+/+", "a/b")
+        assert self.match("a/+/c", "a/b/c")
+        assert not self.match("a/+", "a")
+        assert not self.match("a/+", "a/b/c")
+
+    def test_iter_match__plus_hash(self):
+        assert self.match("a/+/#", "a/b")
+        assert self.match("a/+/#", "a/b/c/d")
+        assert not self.match("a/+/#", "a")
+
+    def test_iter_match__several(self):
+        for sub in ("a/b", "a/+", "+/b", "#", "c"):
+            self.matcher[sub] = sub
+        assert sorted(self.matcher.iter_match("a/b")) == ["#", "+/b", "a/+", "a/b"]
+
+    def test_iter_match__sys(self):
+        assert not self.match("#", "$SYS/a")
+        assert not self.match("+/a", "$SYS/a")
+        assert self.match("$SYS/#", "$SYS/a")
+        assert self.match("$SYS/+", "$SYS/a")
+
+    def test_iter_match__topic_matches_sub(self):
+        levels = ("a", "b", "+", "#", "$SYS", "")
+        subs = ["/".join(x)
+                for n in (1, 2, 3)
+                for x in itertools.product(levels, repeat=n)
+                if not "#" in x[:-1]]
+        # topic_matches_sub doesn't handle empty levels at the end of
+        # topics, e.g. "a/" matching "+/#", so leave those out.
+        topics = ["/".join(x)
+                  for n in (1, 2, 3, 4)
+                  for x in itertools.product(("a", "b", "$SYS", ""), repeat=n)
+                  if x[-1]]
+        for sub in subs:
+            for topic in topics:
+                assert self.match(sub, topic) == mqtt.topic_matches_sub(sub, topic), (sub, topic)
@@ -23,6 +23,7 @@ import "."
 Page {
     id: page
     allowedOrientations: app.defaultAllowedOrientations
+    property bool area: false
     property var lines: []
     property bool loading: false
     property string query: ""
@@ -88,6 +89,13 @@ Page {
                 text: "About"
                 onClicked: app.pageStack.push("AboutPage.qml");
             }
+            MenuItem {
+                text: page.area ? "Track all vehicles" : "Track visible area only"
+                onClicked: {
+                    page.area = !page.area;
+                    py.call("htl.app.filters.set_area", [page.area], null);
+                }
+            }
         }
         ViewPlaceholder {
             id: viewPlaceholder
@@ -158,6 +166,7 @@ Page {
     function loadLines() {
         // Load list of lines from the Python backend.
         var selected = py.call_sync("htl.app.filters.get_lines", []);
+        page.area = py.call_sync("htl.app.filters.get_area", []);
         py.call("htl.app.list_lines", [], function(lines) {
             if (lines.length === 0) {
                 busy.error = "No lines found";
@@ -63,6 +63,15 @@ Map {
         }
     }
 
+    Timer {
+        // Report the visible area to the Python backend
+        // once panning and zooming have settled down.
+        id: viewportTimer
+        interval: 500
+        repeat: false
+        onTriggered: map.updateViewport();
+    }
+
     MouseArea {
         anchors.fill: parent
         onDoubleClicked: map.centerOnPosition();
@@ -86,6 +95,11 @@ Map {
         map.ready = true;
     }
 
+    onCenterChanged: viewportTimer.restart();
+    onHeightChanged: viewportTimer.restart();
+    onWidthChanged: viewportTimer.restart();
+    onZoomLevelChanged: viewportTimer.restart();
+
     gesture.onPinchFinished: {
         // Round piched zoom level to avoid fuzziness.
         if (map.zoomLevel < map.zoomLevelPrev) {
@@ -115,6 +129,7 @@ Map {
         item.type = props.type;
         item.line = props.line;
         item.color = props.color;
+        item.provisional = props.provisional || false;
         map.vehicles.push(item);
         map.addMapItem(item);
     }
@@ -153,6 +168,18 @@ Map {
         map.zoomLevelPrev = zoom;
     }
 
+    function updateViewport() {
+        // Send the bounding box of the visible area to the Python backend.
+        if (!py.ready || map.width <= 0 || map.height <= 0)
+            return viewportTimer.restart();
+        var nw = map.toCoordinate(Qt.point(0, 0));
+        var se = map.toCoordinate(Qt.point(map.width, map.height));
+        if (!nw.isValid || !se.isValid) return;
+        py.call("htl.app.set_viewport", [[
+            nw.longitude, se.latitude,
+            se.longitude, nw.latitude], map.zoomLevel], null);
+    }
+
     function updateVehicle(props) {
         // Update vehicle marker that matches id.
         for (var i = 0; i < map.vehicles.length; i++) {
@@ -164,9 +191,16 @@ Map {
             map.vehicles[i].coordinate = coord;
             map.vehicles[i].bearing = props.bearing;
             map.vehicles[i].line = props.line;
+            map.vehicles[i].provisional = props.provisional || false;
             return;
         }
         // Add missing vehicle.
         map.addVehicle(props);
     }
+
+    function updateVehicles(vehicles) {
+        // Update a batch of vehicle markers.
+        for (var i = 0; i < vehicles.length; i++)
+            map.updateVehicle(vehicles[i]);
+    }
 }
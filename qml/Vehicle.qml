@@ -25,6 +25,9 @@ MapQuickItem {
     id: vehicle
     anchorPoint.x: image.width/2
     anchorPoint.y: image.height/2
+    // Show vehicles from the previous session faded
+    // until confirmed by an update from the server.
+    opacity: vehicle.provisional ? 0.5 : 1.0
     sourceItem: Item {
         Image {
             id: image
@@ -53,6 +56,7 @@ MapQuickItem {
     property double bearing: 0
     property string color: "#007ac9"
     property string line: ""
+    property bool provisional: false
     property string type: "bus"
     property string uid: ""
     Behavior on bearing {
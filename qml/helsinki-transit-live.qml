@@ -35,7 +35,9 @@ ApplicationWindow {
     Python { id: py }
     Component.onCompleted: {
         py.setHandler("remove-all-vehicles", map.removeAllVehicles);
+        py.setHandler("remove-vehicle", map.removeVehicle);
         py.setHandler("update-vehicle", map.updateVehicle);
+        py.setHandler("update-vehicles", map.updateVehicles);
     }
     Component.onDestruction: {
         py.ready && py.call_sync("htl.app.quit", []);
@@ -21,49 +21,108 @@ Public transport vehicles in the Helsinki region.
 https://digitransit.fi/en/developers/apis/4-realtime-api/vehicle-positions/
 """
 
+import collections
 import htl
-import json
+import math
 import paho.mqtt.client
+import re
 import sys
+import threading
 import time
 
+BOOTSTRAP_URL = "http://api.digitransit.fi/realtime/vehicle-positions/v1/hfp/journey/"
 DOMAIN = "mqtt.hsl.fi"
+KEYS = ("long", "lat", "hdg", "tsi")
+LINES_URL = "https://api.digitransit.fi/routing/v1/routers/hsl/index/routes"
+MAX_ROUTES = 4096
+MAX_TILES = 16
 PORT = 1883
 
+# Match transport mode, vehicle id (operator and number) and route
+# without splitting the whole topic, which has plenty of fields.
+# /hfp/v1/journey/ongoing/bus/0012/01314/1065/1/Munkkiniemi/14:33/...
+RE_TOPIC = re.compile(r"/(?:[^/]*/){4}([^/]*)/([^/]*/[^/]*)/([^/]*)/")
+
+TYPES = dict(bus="bus",
+             ferry="ferry",
+             metro="metro",
+             rail="train",
+             subway="metro",
+             train="train",
+             tram="tram")
+
 
 class Tracker:
 
     def __init__(self):
         """Initialize a :class:`Tracker` instance."""
+        self._bootstrap_lock = threading.Lock()
         self._client = None
         self._disconnected = False
+        self._fingerprints = {}
+        self.stats = collections.Counter()
         self._topics = []
+        self._routes = {}
+        self.urls = [BOOTSTRAP_URL, LINES_URL]
         self._utime = -1
         self._init_client()
 
     def _init_client(self):
         """Initialize and connect the MQTT client."""
         self._client = paho.mqtt.client.Client()
+        # Messages are not kept beyond _on_message, which
+        # only needs a bytes-like payload, so skip copies.
+        self._client.message_reuse_set(True)
+        self._client.payload_view_set(True)
         self._client.on_connect  = self._on_connect
         self._client.on_disconnect  = self._on_disconnect
         self._client.on_message = self._on_message
         self._connect()
 
-    @htl.util.silent(Exception, tb=True)
     def bootstrap(self):
         """Fetch the last known positions of vehicles."""
-        self._utime = time.time()
-        url = "http://api.digitransit.fi/realtime/vehicle-positions/v1/hfp/journey/"
-        vehicles = htl.http.get_json(url)
-        lines = htl.app.filters.get_lines()
-        pyotherside.send("remove-all-vehicles")
-        for topic, payload in vehicles.items():
-            parts = topic.split("/")
-            if not parts[8] in lines: continue
+        # Avoid overlapping bootstraps, e.g. at start
+        # and after changing filters right after.
+        with self._bootstrap_lock:
+            self._bootstrap()
+
+    @htl.util.silent(Exception, tb=True)
+    def _bootstrap(self):
+        """Fetch the last known positions of vehicles."""
+        self._utime = start = time.time()
+        lines, tiles = self._get_subscription()
+        lines = set(lines)
+        if tiles is not None:
+            prefixes = tuple(x + "/" for x in tiles)
+        def keep(topic):
+            """Return ``True`` if vehicle at `topic` is tracked."""
+            match = RE_TOPIC.match(topic)
+            if match is None: return False
+            if tiles is None:
+                return match.group(3) in lines
+            if lines and not match.group(3) in lines:
+                return False
+            geohash = "/".join(topic.split("/")[14:]) + "/"
+            return geohash.startswith(prefixes)
+        # The dump covers all vehicles in the region. Parse it as it
+        # downloads and only pick the ones we're tracking, so that
+        # we don't need to hold or decode all of it.
+        chunks = htl.http.get_chunks(BOOTSTRAP_URL)
+        seen = set()
+        for topic, payload in htl.payload.iterobject(chunks, keep):
             message = paho.mqtt.client.MQTTMessage()
             message.topic = topic
-            message.payload = json.dumps(payload)
+            message.payload = payload
             self._on_message(self._client, None, message)
+            seen.add(RE_TOPIC.match(topic).group(2))
+        # Reconcile with vehicles already shown: unchanged ones were
+        # skipped above, moved ones updated and new ones added, which
+        # leaves removing those that are no longer in the dump.
+        # Vehicles updated live while downloading are current though.
+        for id in set(htl.app.registry.ids()) - seen:
+            utime = htl.app.registry.get_utime(id)
+            if utime is not None and utime >= start: continue
+            htl.app.remove_vehicle(id)
 
     def _connect(self):
         """Establish MQTT connection to DOMAIN, PORT."""
@@ -80,14 +139,52 @@ class Tracker:
             return blob.decode("utf_8", errors="replace")
         return blob
 
+    def _get_subscription(self):
+        """Return lines and geohash tiles to subscribe to."""
+        # tiles is None if not tracking by area, in which case
+        # we track all vehicles of the selected lines.
+        lines = htl.app.filters.get_lines()
+        if not htl.app.filters.get_area():
+            return lines, None
+        bbox = htl.app.get_viewport()
+        if bbox is None:
+            return lines, None
+        return lines, self._get_tiles(bbox)
+
+    def _get_tiles(self, bbox):
+        """Return a list of geohash prefixes covering `bbox` or ``None``."""
+        # HFP topics include a geohash, e.g. "60;24/19/73/68", which is
+        # the integer parts of latitude and longitude followed by pairs
+        # of the following decimals, one of latitude and one of longitude.
+        # Find the deepest level at which a few tiles cover bbox.
+        xmin, ymin, xmax, ymax = bbox
+        for depth in (3, 2, 1, 0):
+            k = 10**depth
+            ixmin, ixmax = math.floor(xmin*k), math.floor(xmax*k)
+            iymin, iymax = math.floor(ymin*k), math.floor(ymax*k)
+            if (ixmax - ixmin + 1) * (iymax - iymin + 1) <= MAX_TILES:
+                break
+        else:
+            # Zoomed out too far to limit by area.
+            return None
+        tiles = []
+        for ix in range(ixmin, ixmax + 1):
+            for iy in range(iymin, iymax + 1):
+                tile = "{:d};{:d}".format(iy // k, ix // k)
+                xdigits = str(ix % k).zfill(depth) if depth > 0 else ""
+                ydigits = str(iy % k).zfill(depth) if depth > 0 else ""
+                for ydigit, xdigit in zip(ydigits, xdigits):
+                    tile += "/" + ydigit + xdigit
+                tiles.append(tile)
+        return tiles
+
     @htl.util.api_query(fallback=[])
     def list_lines(self):
         """Return a list of available lines."""
         # XXX: There doesn't seem to be any list of lines available
         # that support realtime information, so we have to get the
         # full list of lines from the Digitransit routing API.
-        url = "https://api.digitransit.fi/routing/v1/routers/hsl/index/routes"
-        lines = htl.http.get_json(url)
+        lines = htl.http.get_json(LINES_URL, cache=True, stale=True)
         lines = [{
             "code": x["id"].replace("HSL:", ""),
             "line": x.get("shortName", self._parse_line(x["id"])),
@@ -124,14 +221,35 @@ class Tracker:
         """Parse and relay updates to positions of vehicles."""
         print("Message: {}".format(message.topic))
         self._utime = time.time()
-        topic = self._ensure_str(message.topic).split("/")
-        payload = self._ensure_str(message.payload)
-        payload = json.loads(payload)["VP"]
+        match = RE_TOPIC.match(self._ensure_str(message.topic))
+        if match is None: raise ValueError
+        mode, id, code = match.groups()
+        line, type = self._parse_route(code, mode)
+        self.stats["received"] += 1
+        tokens = htl.payload.scan(message.payload, KEYS)
+        if tokens is not None:
+            # Vehicles often keep sending the same position, e.g. while
+            # standing at a stop. Compare the raw position and route to the
+            # last ones sent and skip parsing and dispatch if unchanged.
+            # Compare to what we sent, not the registry, which lags behind
+            # by what is still queued in the application's handoff.
+            fingerprint = (code, tokens["long"], tokens["lat"], tokens["hdg"])
+            if (fingerprint == self._fingerprints.get(id) and
+                htl.app.touch_vehicle(id)):
+                self.stats["suppressed"] += 1
+                return
+            payload = htl.payload.parse_tokens(tokens)
+        else:
+            payload = htl.payload.extract(message.payload, KEYS, root="VP")
+            fingerprint = (code,
+                           payload["long"],
+                           payload["lat"],
+                           payload["hdg"])
         vehicle = {
-            "id":   "/".join(topic[6:8]),
-            "code": topic[8],
-            "line": self._parse_line(topic[8]),
-            "type": self._parse_type(topic[5]),
+            "id":   id,
+            "code": code,
+            "line": line,
+            "type": type,
             "x":    float(payload["long"]),
             "y":    float(payload["lat"]),
         }
@@ -139,7 +257,11 @@ class Tracker:
         if vehicle["line"] in ("0", "XXX"): raise ValueError
         with htl.util.silent(Exception):
             vehicle["bearing"] = float(payload["hdg"])
-        htl.app.update_vehicle(vehicle)
+        timestamp = None
+        with htl.util.silent(Exception):
+            timestamp = float(payload["tsi"])
+        self._fingerprints[id] = fingerprint
+        htl.app.update_vehicle(vehicle, timestamp)
 
     def _parse_area(self, code):
         """Parse operation area from `code`."""
@@ -166,31 +288,50 @@ class Tracker:
             line = line[1:].strip()
         return line if line else ""
 
+    def _parse_route(self, code, type):
+        """Parse human readable line and type from `code` and `type`."""
+        # The set of routes is small and the same ones keep repeating
+        # in every message, so cache instead of parsing each time.
+        key = (code, type)
+        if not key in self._routes:
+            # Keys come from the network, keep memory use bounded
+            # even if sent an endless stream of bogus routes.
+            if len(self._routes) >= MAX_ROUTES:
+                self._routes.clear()
+            self._routes[key] = (self._parse_line(code),
+                                 self._parse_type(type))
+        return self._routes[key]
+
     def _parse_type(self, type):
         """Parse human readable type from `type`."""
-        return dict(bus="bus",
-                    ferry="ferry",
-                    metro="metro",
-                    rail="train",
-                    subway="metro",
-                    train="train",
-                    tram="tram").get(type.lower(), "")
+        return TYPES.get(type.lower(), "")
 
     def quit(self):
         """Stop monitoring and disconnect the client."""
         self._client.loop_stop()
         self._client.disconnect()
 
+    def remove_vehicle(self, id):
+        """Forget state kept for vehicle `id`."""
+        self._fingerprints.pop(id, None)
+
     def start(self):
         """Start monitoring for updates to vehicle positions."""
         if self._disconnected:
             self._connect()
         # At application start or after a significant period inactivity
         # (using another application), load a cache dump of last known
-        # vehicle locations and update all vehicles in one go.
+        # vehicle locations and update all vehicles in one go. Do this
+        # in the background to not delay live updates, which take
+        # precedence based on timestamps of positions.
         if time.time() - self._utime > 300:
-            self.bootstrap()
-        self._client.loop_start()
+            # Mark as updated right away, so that another start soon,
+            # e.g. when quickly backgrounded, doesn't bootstrap again.
+            self._utime = time.time()
+            threading.Thread(target=self.bootstrap, daemon=True).start()
+        # Handle all messages readable at once, bursts are common
+        # as vehicles tend to report at the same second.
+        self._client.loop_start(max_packets=0)
 
     def stop(self):
         """Stop monitoring for updates to vehicle positions."""
@@ -198,10 +339,17 @@ class Tracker:
 
     def update_filters(self):
         """Update vehicle filters, return ``True`` if changed."""
-        topics = []
-        filters = htl.app.filters.get_filters()
-        for line in filters.get("lines", []):
-            topics.append("/hfp/v1/journey/+/+/+/+/{}/#".format(line))
+        lines, tiles = self._get_subscription()
+        if tiles is None:
+            topics = ["/hfp/v1/journey/+/+/+/+/{}/#".format(line)
+                      for line in lines]
+        else:
+            # Subscribe per tile, optionally limited to selected lines,
+            # so that the broker only sends us vehicles in the area.
+            topics = ["/hfp/v1/journey/+/+/+/+/{}/+/+/+/+/+/{}/#"
+                      .format(line, tile)
+                      for line in (lines or ["+"])
+                      for tile in tiles]
         changed = False
         for topic in set(self._topics) - set(topics):
             print("Unsubscribe: {}".format(topic))
@@ -18,6 +18,28 @@
 import htl.test
 import importlib.machinery
 import os
+import paho.mqtt.client
+import time
+
+TOPIC = "/hfp/v1/journey/ongoing/bus/0012/01314/{}/1/Munkkiniemi/14:33/1130106/4/60;24/19/73/68"
+PAYLOAD = b'{"VP":{"desi":"65","veh":1314,"tsi":1529321621,"hdg":237,"lat":60.176137,"long":24.938374}}'
+
+
+class Application:
+
+    """Stand-in for :class:`htl.Application` recording vehicle updates."""
+
+    def __init__(self):
+        self.known = set()
+        self.touched = []
+        self.updated = []
+
+    def touch_vehicle(self, id):
+        self.touched.append(id)
+        return id in self.known
+
+    def update_vehicle(self, vehicle, timestamp=None):
+        self.updated.append(vehicle)
 
 
 class TestTracker(htl.test.TestCase):
@@ -26,8 +48,79 @@ class TestTracker(htl.test.TestCase):
         path = os.path.join(os.path.dirname(__file__), "..", "hsl.py")
         loader = importlib.machinery.SourceFileLoader("tracker", path)
         self.tracker = loader.load_module("tracker").Tracker()
+        self.app = htl.app = Application()
+
+    def teardown_method(self, method):
+        del htl.app
+
+    def receive(self, code="1065", payload=PAYLOAD):
+        message = paho.mqtt.client.MQTTMessage()
+        message.topic = TOPIC.format(code)
+        message.payload = payload
+        self.tracker._on_message(None, None, message)
+
+    def test__get_tiles(self):
+        tiles = self.tracker._get_tiles((24.930, 60.160, 24.949, 60.179))
+        assert tiles == ["60;24/19/63", "60;24/19/73", "60;24/19/64", "60;24/19/74"]
+
+    def test__get_tiles__zoomed_out(self):
+        tiles = self.tracker._get_tiles((24.5, 60.0, 25.5, 60.5))
+        assert tiles == ["60;24", "60;25"]
+        assert self.tracker._get_tiles((10.0, 50.0, 30.0, 70.0)) is None
+
+    def test__on_message__not_found(self):
+        self.receive()
+        self.receive()
+        # Vehicle not found by application, e.g. because its
+        # first update is still queued, resend instead of skipping.
+        assert self.app.touched == ["0012/01314"]
+        assert len(self.app.updated) == 2
+
+    def test__on_message__route_changed(self):
+        self.receive()
+        self.app.known.add("0012/01314")
+        self.receive(code="1004")
+        assert self.app.touched == []
+        assert [x["line"] for x in self.app.updated] == ["65", "4"]
+
+    def test__on_message__unchanged(self):
+        self.receive()
+        self.app.known.add("0012/01314")
+        self.receive()
+        assert self.app.touched == ["0012/01314"]
+        assert len(self.app.updated) == 1
+        assert self.tracker.stats["suppressed"] == 1
+
+    def test__parse_route(self):
+        assert self.tracker._parse_route("1065", "bus") == ("65", "bus")
+        assert self.tracker._parse_route("3001I", "train") == ("I", "train")
+        assert self.tracker._parse_route("1004", "tram") == ("4", "tram")
+
+    def test__parse_route__bounded(self):
+        for i in range(10000):
+            self.tracker._parse_route(str(i), "bus")
+        assert len(self.tracker._routes) <= 4096
+        assert self.tracker._parse_route("1065", "bus") == ("65", "bus")
 
     def test_list_lines(self):
         lines = self.tracker.list_lines()
         assert isinstance(lines, list)
         assert len(lines) > 100
+
+    def test_remove_vehicle(self):
+        self.receive()
+        self.app.known.add("0012/01314")
+        self.tracker.remove_vehicle("0012/01314")
+        assert self.tracker._fingerprints == {}
+        self.receive()
+        assert self.app.touched == []
+        assert len(self.app.updated) == 2
+
+    def test_start(self):
+        calls = []
+        self.tracker.bootstrap = lambda: calls.append(1)
+        self.tracker._client.loop_start = lambda **kwargs: None
+        self.tracker.start()
+        self.tracker.start()
+        time.sleep(0.1)
+        assert calls == [1]